@@ -0,0 +1,131 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from ..config.settings import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry(NamedTuple):
+    file_hashes: frozenset
+    numbers: Tuple[str, ...]
+    vector: Optional[np.ndarray]
+    result: Dict
+    created_at: float
+
+
+def _normalize(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _numbers(question: str) -> Tuple[str, ...]:
+    # "trimestre 3" et "trimestre 4" ont des embeddings presque identiques mais pas la même réponse
+    return tuple(sorted(re.findall(r"\d+", question)))
+
+
+class AnswerCache:
+    """
+    Cache des réponses (réponse provisoire + rapport de vérification) par ensemble de documents.
+    Une question identique (à la casse et aux espaces près) est servie sans appel à l'API;
+    une question proche l'est si la similarité cosinus de son embedding dépasse
+    ANSWER_CACHE_SIMILARITY et qu'elle cite les mêmes nombres.
+    La clé inclut l'ensemble des hashes des fichiers: ajouter ou retirer un fichier change la clé
+    de la session, et les réponses de l'ancien ensemble ne sont plus servies qu'aux sessions
+    ayant encore exactement ces documents (éviction LRU et expiration après ANSWER_CACHE_TTL).
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = None, ttl: int = None, threshold: float = None):
+        self.embeddings = embeddings
+        self.max_entries = settings.ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl = settings.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.threshold = settings.ANSWER_CACHE_SIMILARITY if threshold is None else threshold
+        self._entries: "OrderedDict[Tuple[frozenset, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def lookup(self, file_hashes: frozenset, question: str) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """
+        Chercher une réponse pour la question sur cet ensemble de documents.
+        Retourne (réponse ou None, embedding normalisé de la question ou None), l'embedding
+        étant réutilisé par store pour ne pas interroger l'API deux fois.
+        """
+        if self.max_entries <= 0:
+            return None, None
+        key = (file_hashes, _normalize(question))
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                logger.info("Cache de réponses: question identique")
+                return entry.result, None
+
+        vector = self._embed(question)
+        if vector is not None:
+            numbers = _numbers(question)
+            with self._lock:
+                candidates = [
+                    k for k, e in self._entries.items()
+                    if e.file_hashes == file_hashes and e.numbers == numbers and e.vector is not None
+                ]
+                if candidates:
+                    similarities = np.stack([self._entries[k].vector for k in candidates]) @ vector
+                    best = int(np.argmax(similarities))
+                    entry = self._live(candidates[best])
+                    if entry is not None and similarities[best] >= self.threshold:
+                        self._entries.move_to_end(candidates[best])
+                        self.semantic_hits += 1
+                        logger.info(f"Cache de réponses: question proche (similarité {similarities[best]:.3f})")
+                        return entry.result, vector
+
+        with self._lock:
+            self.misses += 1
+        return None, vector
+
+    def store(self, file_hashes: frozenset, question: str, result: Dict, vector: Optional[np.ndarray] = None) -> None:
+        """Enregistrer la réponse d'une question (vector: embedding retourné par lookup)."""
+        if self.max_entries <= 0:
+            return
+        entry = _Entry(file_hashes, _numbers(question), vector, dict(result), time.time())
+        with self._lock:
+            key = (file_hashes, _normalize(question))
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _live(self, key) -> Optional[_Entry]:
+        """Entrée de la clé si elle n'a pas expiré (une entrée expirée est supprimée)."""
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.created_at > self.ttl:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Embedding de la question indisponible pour le cache de réponses: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
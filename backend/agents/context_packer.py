@@ -0,0 +1,115 @@
+import re
+from typing import List, NamedTuple, Set
+from langchain.schema import Document
+from ..config.settings import settings
+from ..utils.tokens import count_tokens, count_tokens_batch
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Marque des phrases omises dans un passage raccourci
+ELLIPSIS = "[…]"
+
+
+class PackedContext(NamedTuple):
+    text: str
+    tokens: int
+    passages: int
+    trimmed: int
+
+
+def _terms(text: str) -> Set[str]:
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 2}
+
+
+def _sentences(text: str) -> List[str]:
+    return [s for s in re.split(r"(?<=[.!?;])\s+|\n+", text) if s.strip()]
+
+
+def _trim(passage: str, query_terms: Set[str], budget: int) -> str:
+    """
+    Raccourcir un passage à budget tokens en gardant les phrases qui couvrent le mieux
+    la requête et leurs voisines (dans leur ordre d'origine).
+    """
+    sentences = _sentences(passage)
+    lengths = count_tokens_batch(sentences)
+    overlaps = [len(query_terms & _terms(sentence)) for sentence in sentences]
+
+    # Phrases les plus proches de la requête d'abord, puis leurs voisines (fenêtre autour des meilleures)
+    best = [i for i, overlap in enumerate(overlaps) if overlap == max(overlaps)]
+    def distance(i):
+        return min(abs(i - b) for b in best)
+    ranked = sorted(range(len(sentences)), key=lambda i: (-overlaps[i], distance(i), i))
+
+    # Chaque phrase retenue peut être précédée d'une marque d'omission
+    gap = count_tokens(f" {ELLIPSIS} ")
+    kept, used = set(), 0
+    for i in ranked:
+        if used + lengths[i] + gap <= budget:
+            kept.add(i)
+            used += lengths[i] + gap
+    if not kept:
+        # Une seule phrase plus longue que le budget: la couper à l'estimation en caractères
+        best = sentences[ranked[0]]
+        return best[:max(1, len(best) * budget // max(1, lengths[ranked[0]]))]
+
+    pieces, previous = [], None
+    for i in sorted(kept):
+        if previous is not None and i != previous + 1:
+            pieces.append(ELLIPSIS)
+        pieces.append(sentences[i])
+        previous = i
+    return " ".join(pieces)
+
+
+def pack_context(query: str, documents: List[Document], budget: int) -> PackedContext:
+    """
+    Construire le contexte d'un prompt dans un budget de tokens.
+    Les passages sont dédupliqués, classés (rang de récupération + couverture des termes de
+    la requête), puis ajoutés tant que le budget le permet; un passage trop long est réduit
+    aux phrases les plus proches de la requête.
+    """
+    query_terms = _terms(query)
+
+    # Dédupliquer (contenu identique aux espaces près, ou passage inclus dans un autre)
+    keys, passages = [], []
+    for doc in documents:
+        text = doc.page_content.strip()
+        key = " ".join(text.split())
+        if not key or any(key in kept for kept in keys):
+            continue
+        contained = [i for i, kept in enumerate(keys) if kept in key]
+        if contained:
+            # Le passage englobant prend le rang du premier passage qu'il contient
+            keys[contained[0]], passages[contained[0]] = key, text
+            keys = [k for i, k in enumerate(keys) if i not in contained[1:]]
+            passages = [p for i, p in enumerate(passages) if i not in contained[1:]]
+        else:
+            keys.append(key)
+            passages.append(text)
+    if not passages:
+        return PackedContext("", 0, 0, 0)
+
+    # Score: rang réciproque de la récupération hybride + part des termes de la requête couverts
+    def score(rank):
+        coverage = len(query_terms & _terms(passages[rank])) / len(query_terms) if query_terms else 0.0
+        return 1.0 / (1 + rank) + coverage
+    passages = [passages[rank] for rank in sorted(range(len(passages)), key=score, reverse=True)]
+
+    separator = count_tokens("\n\n")
+    max_passage = settings.CONTEXT_MAX_PASSAGE_TOKENS
+    selected, used, trimmed = [], 0, 0
+    for text, length in zip(passages, count_tokens_batch(passages)):
+        remaining = budget - used - (separator if selected else 0)
+        if remaining < settings.CONTEXT_MIN_PASSAGE_TOKENS:
+            break
+        limit = min(remaining, max_passage)
+        if length > limit:
+            text = _trim(text, query_terms, limit)
+            length = count_tokens(text)
+            trimmed += 1
+        selected.append(text)
+        used += length + (separator if len(selected) > 1 else 0)
+
+    logger.info(f"Contexte: {len(selected)}/{len(documents)} passages, {used}/{budget} tokens, {trimmed} raccourcis")
+    return PackedContext("\n\n".join(selected), used, len(selected), trimmed)
@@ -1,37 +1,123 @@
-from langchain_mistralai import ChatMistralAI
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+from langchain.schema import Document
+from .context_packer import pack_context
+from ..config import constants
 from ..config.settings import settings
+from ..utils.clients import get_chat_model
 import logging
 
 logger = logging.getLogger(__name__)
 
 class RelevanceChecker:
+    # Chemins de décision suivis dans les métriques
+    PATHS = ("no_documents", "score_can_answer", "score_no_match", "llm")
+
     def __init__(self):
-        self.model = ChatMistralAI(
-            model=settings.MODEL_ID,
-            api_key=settings.MISTRALAI_API_KEY,
-            temperature=0,
-            max_tokens=10,
-        )
-
-    def check(self, question: str, retriever, k=3) -> str:
+        # La classification ne produit qu'un label: un modèle plus petit suffit
+        self.model = get_chat_model(temperature=0, max_tokens=10, model=settings.RELEVANCE_MODEL_ID)
+        self._paths = Counter()
+        self._lock = threading.Lock()
+
+    def check(self, question: str, documents: List[Document], k=3) -> str:
         """
-        1. Récupérer les k premiers chunks de documents depuis le récupérateur global.
-        2. Les combiner en une seule chaîne de texte.
-        3. Passer ce texte + question au LLM pour classification.
+        1. Prendre les k premiers chunks parmi les documents déjà récupérés pour la question.
+        2. Décider sans LLM si leurs scores de récupération sont clairement hauts ou bas.
+        3. Sinon, combiner les chunks en une seule chaîne de texte.
+        4. Passer ce texte + question au LLM pour classification.
 
-        Retourne: "CAN_ANSWER", "PARTIAL", ou "NO_MATCH".
+        Retourne: "CAN_ANSWER", "PARTIAL", "NO_MATCH", ou "ERROR" si le modèle n'a pas pu
+        être interrogé (erreur transitoire, à ne pas confondre avec une question hors sujet).
         """
 
         logger.debug(f"RelevanceChecker.check appelé avec question='{question}' et k={k}")
+        decision = self._decide_from_scores(documents, k)
+        if decision is not None:
+            return decision
+        prompt = self._build_prompt(question, documents, k)
+
+        # Appeler le LLM
+        self._count("llm")
+        try:
+            response = self.model.invoke(prompt)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'inférence du modèle: {e}")
+            return "ERROR"
+
+        return self._classify(response)
+
+    async def acheck(self, question: str, documents: List[Document], k=3) -> str:
+        """Version asynchrone de check (appel non bloquant au LLM)."""
+
+        logger.debug(f"RelevanceChecker.acheck appelé avec question='{question}' et k={k}")
+        decision = self._decide_from_scores(documents, k)
+        if decision is not None:
+            return decision
+        prompt = self._build_prompt(question, documents, k)
+
+        self._count("llm")
+        try:
+            response = await self.model.ainvoke(prompt)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'inférence du modèle: {e}")
+            return "ERROR"
 
-        # Récupérer les chunks de documents depuis le récupérateur d'ensemble
-        top_docs = retriever.invoke(question)
-        if not top_docs:
-            logger.debug("Aucun document retourné par retriever.invoke(). Classification comme NO_MATCH.")
+        return self._classify(response)
+
+    def _decide_from_scores(self, documents: List[Document], k: int) -> Optional[str]:
+        """
+        Classification sans LLM à partir des scores calibrés des k premiers chunks:
+        - aucun document: NO_MATCH;
+        - un signal (BM25 ou cosinus) au-dessus de son seuil haut: CAN_ANSWER;
+        - tous les signaux disponibles sous leur seuil bas: NO_MATCH;
+        - sinon None (zone ambiguë, confiée au modèle).
+        """
+        if not documents:
+            logger.debug("Aucun document récupéré pour la question. Classification comme NO_MATCH.")
+            self._count("no_documents")
+            return "NO_MATCH"
+        if not settings.RELEVANCE_FAST_PATH:
+            return None
+
+        top_docs = documents[:k]
+        score_keys = (constants.BM25_SCORE_KEY, constants.VECTOR_SCORE_KEY)
+        if not any(key in doc.metadata for doc in top_docs for key in score_keys):
+            # Récupérateur sans scores calibrés: décision confiée au modèle
+            return None
+        # Un chunk sans score BM25 ne contient aucun terme de la requête
+        bm25 = max(doc.metadata.get(constants.BM25_SCORE_KEY, 0.0) for doc in top_docs)
+        vector_scores = [doc.metadata[constants.VECTOR_SCORE_KEY] for doc in top_docs if constants.VECTOR_SCORE_KEY in doc.metadata]
+        vector = max(vector_scores) if vector_scores else None
+        logger.debug(f"Scores de pertinence: bm25={bm25:.3f}, cosinus={vector if vector is None else round(vector, 3)}")
+
+        if bm25 >= settings.RELEVANCE_BM25_HIGH or (vector is not None and vector >= settings.RELEVANCE_VECTOR_HIGH):
+            self._count("score_can_answer")
+            return "CAN_ANSWER"
+        if bm25 < settings.RELEVANCE_BM25_LOW and (vector is None or vector < settings.RELEVANCE_VECTOR_LOW):
+            self._count("score_no_match")
             return "NO_MATCH"
+        return None
+
+    def _count(self, path: str) -> None:
+        with self._lock:
+            self._paths[path] += 1
+
+    def stats(self) -> Dict:
+        """Nombre et part des questions par chemin de décision."""
+        with self._lock:
+            total = sum(self._paths.values())
+            return {
+                "total": total,
+                **{path: self._paths[path] for path in self.PATHS},
+                "llm_rate": self._paths["llm"] / total if total else 0.0,
+            }
+
+    def _build_prompt(self, question: str, documents: List[Document], k: int) -> str:
+        """Prompt de classification des k premiers documents (issus de l'unique passe de récupération)."""
 
-        # Combiner les k premiers chunks de texte en une seule chaîne
-        document_content = "\n\n".join(doc.page_content for doc in top_docs[:k])
+        # Combiner les k premiers chunks de texte en une seule chaîne, dans le budget de tokens
+        document_content = pack_context(question, documents[:k], settings.RELEVANCE_CONTEXT_TOKENS).text
 
         # Créer un prompt pour le LLM afin de classifier la pertinence
         prompt = f"""
@@ -54,14 +140,9 @@ class RelevanceChecker:
 
         **Répondez UNIQUEMENT avec un des labels suivants: CAN_ANSWER, PARTIAL, NO_MATCH**
         """
+        return prompt
 
-        # Appeler le LLM
-        try:
-            response = self.model.invoke(prompt)
-        except Exception as e:
-            logger.error(f"Erreur lors de l'inférence du modèle: {e}")
-            return "NO_MATCH"
-
+    def _classify(self, response) -> str:
         # Extraire le contenu de la réponse
         try:
             llm_response = response.content.strip()
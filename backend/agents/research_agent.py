@@ -1,7 +1,8 @@
 from typing import Dict, List
 from langchain.schema import Document
-from langchain_mistralai import ChatMistralAI
+from .context_packer import pack_context
 from ..config.settings import settings
+from ..utils.clients import get_chat_model
 
 class ResearchAgent:
     def __init__(self):
@@ -10,12 +11,7 @@ class ResearchAgent:
         """
 
         print("Initialisation de ResearchAgent avec Mistral ChatMistralAI...")
-        self.model = ChatMistralAI(
-            model=settings.MODEL_ID,
-            api_key=settings.MISTRALAI_API_KEY,
-            temperature=0.3,
-            max_tokens=300,
-        )
+        self.model = get_chat_model(temperature=0.3, max_tokens=300)
         print("ModelInference initialisé avec succès.")
 
     def sanitize_response(self, response_text: str) -> str:
@@ -49,14 +45,7 @@ class ResearchAgent:
         Générer une réponse initiale en utilisant les documents fournis.
         """
         print(f"ResearchAgent.generate appelé avec question='{question}' et {len(documents)} documents.")
-
-        # Combiner le contenu des documents principaux en une seule chaîne
-        context = "\n\n".join([doc.page_content for doc in documents])
-        print(f"Longueur du contexte combiné: {len(context)} caractères.")
-
-        # Créer un prompt pour le LLM
-        prompt = self.generate_prompt(question, context)
-        print("Prompt créé pour le LLM.")
+        prompt, packed = self._build_prompt(question, documents)
 
         # Appeler le LLM pour générer la réponse
         try:
@@ -67,6 +56,35 @@ class ResearchAgent:
             print(f"Erreur lors de l'inférence du modèle: {e}")
             raise RuntimeError("Échec de la génération de réponse en raison d'une erreur de modèle.") from e
 
+        return self._parse_response(response, packed)
+
+    async def agenerate(self, question: str, documents: List[Document]) -> Dict:
+        """
+        Version asynchrone de generate (appel non bloquant au LLM).
+        """
+        print(f"ResearchAgent.agenerate appelé avec question='{question}' et {len(documents)} documents.")
+        prompt, packed = self._build_prompt(question, documents)
+
+        try:
+            response = await self.model.ainvoke(prompt)
+        except Exception as e:
+            print(f"Erreur lors de l'inférence du modèle: {e}")
+            raise RuntimeError("Échec de la génération de réponse en raison d'une erreur de modèle.") from e
+
+        return self._parse_response(response, packed)
+
+    def _build_prompt(self, question: str, documents: List[Document]):
+        # Combiner les passages les plus pertinents dans le budget de tokens de l'agent
+        packed = pack_context(question, documents, settings.RESEARCH_CONTEXT_TOKENS)
+        context = packed.text
+        print(f"Contexte: {packed.passages} passages, {packed.tokens} tokens ({packed.trimmed} raccourcis).")
+
+        # Créer un prompt pour le LLM
+        prompt = self.generate_prompt(question, context)
+        print("Prompt créé pour le LLM.")
+        return prompt, packed
+
+    def _parse_response(self, response, packed) -> Dict:
         # Extraire et traiter la réponse du LLM
         try:
             llm_response = response.content.strip()
@@ -82,5 +100,6 @@ class ResearchAgent:
 
         return {
             "draft_answer": draft_answer,
-            "context_used": context
+            "context_used": packed.text,
+            "context_tokens": packed.tokens
         }
@@ -1,21 +1,20 @@
 from typing import Dict, List
 from langchain.schema import Document
-from langchain_mistralai import ChatMistralAI
+from .context_packer import pack_context
 from ..config.settings import settings
+from ..utils.clients import get_chat_model
 
 class VerificationAgent:
+    # Clés du format de réponse attendu (insensibles à la casse à la lecture)
+    FIELDS = ["Supported", "Unsupported Claims", "Contradictions", "Relevant", "Additional Details"]
+
     def __init__(self):
         """
         Initialiser l'agent de vérification avec Mistral ChatMistralAI.
         """
         # Initialiser Mistral ChatMistralAI
         print("Initialisation de VerificationAgent avec Mistral ChatMistralAI...")
-        self.model = ChatMistralAI(
-            model=settings.MODEL_ID,
-            api_key=settings.MISTRALAI_API_KEY,
-            temperature=0,
-            max_tokens=200,
-        )
+        self.model = get_chat_model(temperature=0, max_tokens=200)
         print("ModelInference initialisé avec succès.")
 
     def sanitize_response(self, response_text: str) -> str:
@@ -62,18 +61,20 @@ class VerificationAgent:
         """
         try:
             lines = response_text.split('\n')
+            fields = {field.lower(): field for field in self.FIELDS}
             verification = {}
             for line in lines:
                 if ':' in line:
                     parts = line.split(':', 1)
                     if len(parts) == 2:
                         key, value = parts
-                        key = key.strip().capitalize()
-                        value = value.strip()
+                        # Tolérer la mise en forme markdown (**Supported:** NON)
+                        key = fields.get(key.strip().strip('*').strip().lower(), key)
+                        value = value.strip().strip('*').strip()
                     else:
                         continue
-                    if key in {"Supported", "Unsupported claims", "Contradictions", "Relevant", "Additional details"}:
-                        if key in {"Unsupported claims", "Contradictions"}:
+                    if key in fields.values():
+                        if key in {"Unsupported Claims", "Contradictions"}:
                             # Convert string list to actual list
                             if value.startswith('[') and value.endswith(']'):
                                 items = value[1:-1].split(',')
@@ -82,12 +83,12 @@ class VerificationAgent:
                                 verification[key] = items
                             else:
                                 verification[key] = []
-                        elif key == "Additional details":
+                        elif key == "Additional Details":
                             verification[key] = value
                         else:
                             verification[key] = value.upper()
             # Ensure all keys are present
-            for key in ["Supported", "Unsupported Claims", "Contradictions", "Relevant", "Additional Details"]:
+            for key in self.FIELDS:
                 if key not in verification:
                     if key in {"Unsupported Claims", "Contradictions"}:
                         verification[key] = []
@@ -136,14 +137,7 @@ class VerificationAgent:
         Vérifier la réponse par rapport aux documents fournis.
         """
         print(f"VerificationAgent.check appelé avec answer='{answer}' et {len(documents)} documents.")
-
-        # Combiner tous les contenus de documents en une seule chaîne sans troncature
-        context = "\n\n".join([doc.page_content for doc in documents])
-        print(f"Longueur du contexte combiné: {len(context)} caractères.")
-
-        # Créer un prompt pour le LLM afin de vérifier la réponse
-        prompt = self.generate_prompt(answer, context)
-        print("Prompt créé pour le LLM.")
+        prompt, packed = self._build_prompt(answer, documents)
 
         # Appeler le LLM pour générer le rapport de vérification
         try:
@@ -154,6 +148,37 @@ class VerificationAgent:
             print(f"Erreur lors de l'inférence du modèle: {e}")
             raise RuntimeError("Échec de la vérification de la réponse en raison d'une erreur du modèle.") from e
 
+        return self._build_report(response, packed)
+
+    async def acheck(self, answer: str, documents: List[Document]) -> Dict:
+        """
+        Version asynchrone de check (appel non bloquant au LLM).
+        """
+        print(f"VerificationAgent.acheck appelé avec answer='{answer}' et {len(documents)} documents.")
+        prompt, packed = self._build_prompt(answer, documents)
+
+        try:
+            response = await self.model.ainvoke(prompt)
+        except Exception as e:
+            print(f"Erreur lors de l'inférence du modèle: {e}")
+            raise RuntimeError("Échec de la vérification de la réponse en raison d'une erreur du modèle.") from e
+
+        return self._build_report(response, packed)
+
+    def _build_prompt(self, answer: str, documents: List[Document]):
+        # Passages classés par proximité avec la réponse à vérifier, dans le budget de tokens de l'agent
+        packed = pack_context(answer, documents, settings.VERIFICATION_CONTEXT_TOKENS)
+        context = packed.text
+        print(f"Contexte: {packed.passages} passages, {packed.tokens} tokens ({packed.trimmed} raccourcis).")
+
+        # Créer un prompt pour le LLM afin de vérifier la réponse
+        prompt = self.generate_prompt(answer, context)
+        print("Prompt créé pour le LLM.")
+        return prompt, packed
+
+    def _build_report(self, response, packed) -> Dict:
+        context = packed.text
+
         # Extraire et traiter la réponse du LLM
         try:
             llm_response = response.content.strip()
@@ -172,7 +197,9 @@ class VerificationAgent:
             print(f"Contexte utilisé: {context}")
             return {
                 "verification_report": verification_report_formatted,
-                "context_used": context
+                "verification": verification_report,
+                "context_used": context,
+                "context_tokens": packed.tokens
             }
 
         # Nettoyer la réponse
@@ -206,5 +233,7 @@ class VerificationAgent:
 
         return {
             "verification_report": verification_report_formatted,
-            "context_used": context
+            "verification": verification_report,
+            "context_used": context,
+            "context_tokens": packed.tokens
         }
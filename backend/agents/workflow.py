@@ -1,83 +1,169 @@
-from langgraph.graph import StateGraph, END
-from typing import TypedDict, List, Dict
+from langgraph.graph import StateGraph, START, END
+from typing import TypedDict, List, Dict, Iterator, Tuple
 from .research_agent import ResearchAgent
 from .verification_agent import VerificationAgent
 from .relevance_checker import RelevanceChecker
+from ..retriever.reranker import Reranker
 from langchain.schema import Document
 from langchain.retrievers import EnsembleRetriever
+from langchain_core.runnables import RunnableLambda
+from ..config import constants
+from ..config.settings import settings
+from ..utils.clients import lazy_singleton
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+NO_MATCH_ANSWER = "Cette question n'est pas liée (ou il n'y a pas de données) pour votre requête. Veuillez poser une autre question pertinente aux document(s) téléchargé(s)."
+RELEVANCE_ERROR_ANSWER = "La pertinence de la question n'a pas pu être vérifiée (modèle indisponible). Veuillez réessayer dans quelques instants."
+
+# Verdicts dont la réponse ne doit pas être mise en cache (hors sujet ou erreur transitoire)
+UNCACHEABLE_RELEVANCE = ("NO_MATCH", "ERROR")
+
 class AgentState(TypedDict):
     question: str
     documents: List[Document]
     draft_answer: str
     verification_report: str
     is_relevant: bool
-    retriever: EnsembleRetriever
+    # Verdict du vérificateur de pertinence: CAN_ANSWER, PARTIAL, NO_MATCH ou ERROR
+    relevance: str
+    verification: Dict
+    # Boucle recherche/vérification: passes effectuées, réponse précédente et taille du contexte
+    iteration: int
+    previous_draft: str
+    context_k: int
+    # Sections parentes des passages (identifiant -> section), utilisées à la place des passages après élargissement
+    parents: Dict[str, Document]
+    expanded: bool
 
 class AgentWorkflow:
     def __init__(self):
         self.researcher = ResearchAgent()
         self.verifier = VerificationAgent()
         self.relevance_checker = RelevanceChecker()
+        self.reranker = Reranker()
         self.compiled_workflow = self.build_workflow()  # Compile once during initialization
 
     def build_workflow(self):
         """Créer et compiler le workflow multi-agents."""
         workflow = StateGraph(AgentState)
 
-        # Ajouter les nœuds
-        workflow.add_node("check_relevance", self._check_relevance_step)
-        workflow.add_node("research", self._research_step)
-        workflow.add_node("verify", self._verification_step)
+        # Ajouter les nœuds (version asynchrone utilisée par ainvoke/astream)
+        workflow.add_node("research", RunnableLambda(self._research_step, afunc=self._aresearch_step))
+        workflow.add_node("verify", RunnableLambda(self._verification_step, afunc=self._averification_step))
+        workflow.add_node("expand_context", self._expand_context_step)
 
         # Définir les arêtes
-        workflow.set_entry_point("check_relevance")
+        if settings.SPECULATIVE_RESEARCH:
+            # La vérification de pertinence et la première recherche partent en parallèle;
+            # la porte attend les deux et écarte la réponse si la question est hors sujet
+            workflow.add_node("check_relevance", RunnableLambda(self._speculative_relevance_step, afunc=self._aspeculative_relevance_step))
+            workflow.add_node("speculative_research", RunnableLambda(self._research_step, afunc=self._aresearch_step))
+            workflow.add_node("relevance_gate", self._relevance_gate_step)
+            workflow.add_edge(START, "check_relevance")
+            workflow.add_edge(START, "speculative_research")
+            workflow.add_edge(["check_relevance", "speculative_research"], "relevance_gate")
+            workflow.add_conditional_edges(
+                "relevance_gate",
+                self._decide_after_gate,
+                {
+                    "verify": "verify",
+                    "end": END
+                }
+            )
+        else:
+            workflow.add_node("check_relevance", RunnableLambda(self._check_relevance_step, afunc=self._acheck_relevance_step))
+            workflow.set_entry_point("check_relevance")
+            workflow.add_conditional_edges(
+                "check_relevance",
+                self._decide_after_relevance_check,
+                {
+                    "relevant": "research",
+                    "irrelevant": END
+                }
+            )
         workflow.add_conditional_edges(
-            "check_relevance",
-            self._decide_after_relevance_check,
+            "research",
+            self._decide_after_research,
             {
-                "relevant": "research",
-                "irrelevant": END
+                "verify": "verify",
+                "end": END
             }
         )
-        workflow.add_edge("research", "verify")
         workflow.add_conditional_edges(
             "verify",
             self._decide_next_step,
             {
-                "re_research": "research",
+                "re_research": "expand_context",
                 "end": END
             }
         )
+        workflow.add_edge("expand_context", "research")
         return workflow.compile()
 
     def _check_relevance_step(self, state: AgentState) -> Dict:
-        retriever = state["retriever"]
         classification = self.relevance_checker.check(
             question=state["question"],
-            retriever=retriever,
+            documents=state["documents"],
+            k=20
+        )
+        return self._relevance_update(classification)
+
+    async def _acheck_relevance_step(self, state: AgentState) -> Dict:
+        classification = await self.relevance_checker.acheck(
+            question=state["question"],
+            documents=state["documents"],
             k=20
         )
+        return self._relevance_update(classification)
 
+    def _relevance_update(self, classification: str) -> Dict:
         if classification == "CAN_ANSWER":
             # Nous avons assez d'informations pour continuer
-            return {"is_relevant": True}
+            return {"is_relevant": True, "relevance": classification}
 
         elif classification == "PARTIAL":
             # Il y a une couverture partielle, mais nous pouvons quand même continuer
             return {
-                "is_relevant": True
+                "is_relevant": True,
+                "relevance": classification
             }
 
-        else:  # classification == "NO_MATCH"
+        else:  # classification == "NO_MATCH" ou "ERROR"
             return {
                 "is_relevant": False,
-                "draft_answer": "Cette question n'est pas liée (ou il n'y a pas de données) pour votre requête. Veuillez poser une autre question pertinente aux document(s) téléchargé(s)."
+                "relevance": classification,
+                "draft_answer": self._irrelevant_answer(classification)
             }
 
+    @staticmethod
+    def _irrelevant_answer(classification: str) -> str:
+        # Une erreur du modèle n'est pas présentée comme une question hors sujet
+        return RELEVANCE_ERROR_ANSWER if classification == "ERROR" else NO_MATCH_ANSWER
+
+    def _speculative_relevance_step(self, state: AgentState) -> Dict:
+        # La réponse provisoire est écrite par la recherche parallèle, puis par la porte
+        update = self._check_relevance_step(state)
+        return {"is_relevant": update["is_relevant"], "relevance": update["relevance"]}
+
+    async def _aspeculative_relevance_step(self, state: AgentState) -> Dict:
+        update = await self._acheck_relevance_step(state)
+        return {"is_relevant": update["is_relevant"], "relevance": update["relevance"]}
+
+    def _relevance_gate_step(self, state: AgentState) -> Dict:
+        """Porte de la recherche spéculative: écarter la réponse si la question est hors sujet."""
+        if state["is_relevant"]:
+            return {}
+        logger.info(f"[DEBUG] Verdict {state['relevance']}, réponse spéculative écartée.")
+        return {"draft_answer": self._irrelevant_answer(state["relevance"]), "previous_draft": "", "iteration": 0}
+
+    def _decide_after_gate(self, state: AgentState) -> str:
+        decision = "verify" if state["is_relevant"] else "end"
+        print(f"[DEBUG] _decide_after_gate -> {decision}")
+        return decision
+
 
     def _decide_after_relevance_check(self, state: AgentState) -> str:
         decision = "relevant" if state["is_relevant"] else "irrelevant"
@@ -87,46 +173,218 @@ class AgentWorkflow:
     def full_pipeline(self, question: str, retriever: EnsembleRetriever):
         try:
             print(f"[DEBUG] Démarrage du pipeline complet avec question='{question}'")
-            documents = retriever.invoke(question)
-            logger.info(f"Récupéré {len(documents)} documents pertinents (depuis .invoke)")
-
-            initial_state = AgentState(
-                question=question,
-                documents=documents,
-                draft_answer="",
-                verification_report="",
-                is_relevant=False,
-                retriever=retriever
-            )
-
+            documents = self._retrieve(question, retriever)
+            initial_state = self._initial_state(question, documents, self._parents(retriever, documents))
             final_state = self.compiled_workflow.invoke(initial_state)
 
             return {
                 "draft_answer": final_state["draft_answer"],
-                "verification_report": final_state["verification_report"]
+                "verification_report": final_state["verification_report"],
+                "relevance": final_state["relevance"]
             }
         except Exception as e:
             logger.error(f"L'exécution du workflow a échoué: {e}")
             raise
 
+    async def afull_pipeline(self, question: str, retriever: EnsembleRetriever):
+        """Version asynchrone de full_pipeline: aucun thread n'est bloqué pendant les appels au LLM."""
+        try:
+            print(f"[DEBUG] Démarrage du pipeline asynchrone avec question='{question}'")
+            documents = await self._aretrieve(question, retriever)
+            initial_state = self._initial_state(question, documents, self._parents(retriever, documents))
+            final_state = await self.compiled_workflow.ainvoke(initial_state)
+
+            return {
+                "draft_answer": final_state["draft_answer"],
+                "verification_report": final_state["verification_report"],
+                "relevance": final_state["relevance"]
+            }
+        except Exception as e:
+            logger.error(f"L'exécution du workflow asynchrone a échoué: {e}")
+            raise
+
+    def stream_pipeline(self, question: str, retriever: EnsembleRetriever) -> Iterator[Tuple[str, Dict]]:
+        """
+        Exécuter le workflow en diffusant les tokens de l'agent de recherche dès leur génération.
+        Produit des événements (type, données): "token" pendant la recherche, "draft" à la fin de
+        chaque passe de recherche, "verification" après la vérification, puis "done".
+        En mode spéculatif, les événements de la recherche sont retenus jusqu'au verdict de
+        pertinence, et abandonnés si la question est hors sujet.
+        """
+        try:
+            print(f"[DEBUG] Démarrage du pipeline en streaming avec question='{question}'")
+            documents = self._retrieve(question, retriever)
+            final_state = self._initial_state(question, documents, self._parents(retriever, documents))
+            # Événements de la recherche spéculative retenus tant que le verdict de pertinence est inconnu
+            pending, verdict = [], None
+
+            for mode, chunk in self.compiled_workflow.stream(final_state, stream_mode=["messages", "updates"]):
+                events = []
+                if mode == "messages":
+                    # Tokens du LLM: seuls ceux des nœuds de recherche sont transmis au client
+                    message, metadata = chunk
+                    node = metadata.get("langgraph_node")
+                    if node in {"research", "speculative_research"} and message.content:
+                        events.append((node, "token", {"text": message.content}))
+                else:
+                    for node, update in chunk.items():
+                        if not update:
+                            continue
+                        final_state = {**final_state, **update}
+                        if node == "check_relevance":
+                            verdict = update["is_relevant"]
+                        if "draft_answer" in update:
+                            events.append((node, "draft", {"draft_answer": update["draft_answer"]}))
+                        if "verification_report" in update:
+                            events.append((node, "verification", {"verification_report": update["verification_report"]}))
+
+                if verdict and pending:
+                    yield from pending
+                    pending = []
+                for node, event, data in events:
+                    if node == "speculative_research" and not verdict:
+                        # Abandonnés si la question est hors sujet
+                        if verdict is None:
+                            pending.append((event, data))
+                        continue
+                    yield event, data
+
+            yield "done", {
+                "draft_answer": final_state["draft_answer"],
+                "verification_report": final_state["verification_report"],
+                "relevance": final_state["relevance"]
+            }
+        except Exception as e:
+            logger.error(f"L'exécution du workflow en streaming a échoué: {e}")
+            raise
+
+    def _retrieve(self, question: str, retriever) -> List[Document]:
+        """Candidats du récupérateur, reclassés localement si un reranker est configuré."""
+        return self.reranker.rerank(question, retriever.invoke(question))
+
+    async def _aretrieve(self, question: str, retriever) -> List[Document]:
+        documents = await retriever.ainvoke(question)
+        if not self.reranker.enabled:
+            return documents
+        # Reclassement sur CPU (cross-encoder) hors de la boucle d'événements
+        return await asyncio.to_thread(self.reranker.rerank, question, documents)
+
+    def _parents(self, retriever, documents: List[Document]) -> Dict[str, Document]:
+        """Sections parentes des passages récupérés (vide si le récupérateur n'en fournit pas)."""
+        parent_documents = getattr(retriever, "parent_documents", None)
+        return parent_documents(documents) if parent_documents is not None else {}
+
+    def _initial_state(self, question: str, documents: List[Document], parents: Dict[str, Document] = None) -> AgentState:
+        logger.info(f"Récupéré {len(documents)} documents pertinents")
+
+        return AgentState(
+            question=question,
+            documents=documents,
+            draft_answer="",
+            verification_report="",
+            is_relevant=False,
+            relevance="",
+            verification={},
+            iteration=0,
+            previous_draft="",
+            # Avec un reranker, seuls les premiers passages reclassés partent au LLM
+            context_k=settings.RERANK_TOP_N if self.reranker.enabled else settings.RESEARCH_CONTEXT_K,
+            parents=parents or {},
+            expanded=False
+        )
+
+    def _context(self, state: AgentState) -> List[Document]:
+        """
+        Passages utilisés pour la passe courante: les context_k premiers documents classés,
+        remplacés par leurs sections parentes (une fois chacune) après élargissement.
+        """
+        documents = state["documents"][:state["context_k"]]
+        if not state.get("expanded"):
+            return documents
+        context, seen = [], set()
+        for doc in documents:
+            parent_id = doc.metadata.get(constants.PARENT_ID_KEY)
+            if parent_id in state["parents"]:
+                if parent_id in seen:
+                    continue
+                seen.add(parent_id)
+                doc = state["parents"][parent_id]
+            context.append(doc)
+        return context
+
+    def _can_expand(self, state: AgentState) -> bool:
+        """Vrai si une section parente apporte du texte au-delà des passages de la passe courante."""
+        if state.get("expanded"):
+            return False
+        parents = state.get("parents", {})
+        return any(
+            doc.metadata.get(constants.PARENT_ID_KEY) in parents
+            and len(parents[doc.metadata[constants.PARENT_ID_KEY]].page_content) > len(doc.page_content)
+            for doc in state["documents"][:state["context_k"]]
+        )
+
+    def _research_update(self, state: AgentState, result: Dict) -> Dict:
+        return {
+            "draft_answer": result["draft_answer"],
+            "previous_draft": state["draft_answer"],
+            "iteration": state["iteration"] + 1
+        }
+
     def _research_step(self, state: AgentState) -> Dict:
         print(f"[DEBUG] Entrée dans _research_step avec question='{state['question']}'")
-        result = self.researcher.generate(state["question"], state["documents"])
+        result = self.researcher.generate(state["question"], self._context(state))
         print("[DEBUG] Le chercheur a retourné une réponse provisoire.")
-        return {"draft_answer": result["draft_answer"]}
+        return self._research_update(state, result)
+
+    async def _aresearch_step(self, state: AgentState) -> Dict:
+        print(f"[DEBUG] Entrée dans _aresearch_step avec question='{state['question']}'")
+        result = await self.researcher.agenerate(state["question"], self._context(state))
+        return self._research_update(state, result)
+
+    def _decide_after_research(self, state: AgentState) -> str:
+        # Réponse inchangée après élargissement du contexte: le rapport précédent reste valable
+        if state["iteration"] > 1 and " ".join(state["draft_answer"].split()) == " ".join(state["previous_draft"].split()):
+            logger.info("[DEBUG] Réponse identique à la passe précédente, fin du workflow.")
+            return "end"
+        return "verify"
 
     def _verification_step(self, state: AgentState) -> Dict:
         print("[DEBUG] Entrée dans _verification_step. Vérification de la réponse provisoire...")
-        result = self.verifier.check(state["draft_answer"], state["documents"])
+        result = self.verifier.check(state["draft_answer"], self._context(state))
         print("[DEBUG] L'agent de vérification a retourné un rapport de vérification.")
-        return {"verification_report": result["verification_report"]}
+        return {"verification_report": result["verification_report"], "verification": result["verification"]}
+
+    async def _averification_step(self, state: AgentState) -> Dict:
+        print("[DEBUG] Entrée dans _averification_step. Vérification de la réponse provisoire...")
+        result = await self.verifier.acheck(state["draft_answer"], self._context(state))
+        return {"verification_report": result["verification_report"], "verification": result["verification"]}
+
+    def _expand_context_step(self, state: AgentState) -> Dict:
+        """
+        Élargir le contexte avant une nouvelle passe de recherche: d'abord les sections parentes
+        des mêmes passages, puis davantage de passages.
+        """
+        if self._can_expand(state):
+            logger.info("[DEBUG] Nouvelle recherche avec les sections parentes des passages.")
+            return {"expanded": True}
+        context_k = state["context_k"] + settings.RESEARCH_CONTEXT_STEP
+        logger.info(f"[DEBUG] Nouvelle recherche avec {min(context_k, len(state['documents']))} passages.")
+        return {"context_k": context_k}
 
     def _decide_next_step(self, state: AgentState) -> str:
-        verification_report = state["verification_report"]
-        print(f"[DEBUG] _decide_next_step avec verification_report='{verification_report}'")
-        if "Supported: NO" in verification_report or "Relevant: NO" in verification_report:
-            logger.info("[DEBUG] La vérification indique qu'une nouvelle recherche est nécessaire.")
-            return "re_research"
-        else:
+        verification = state["verification"]
+        print(f"[DEBUG] _decide_next_step avec verification={verification}")
+        if verification.get("Supported") not in {"NON", "NO"} and verification.get("Relevant") not in {"NON", "NO"}:
             logger.info("[DEBUG] Vérification réussie, fin du workflow.")
             return "end"
+        if state["iteration"] >= settings.MAX_RESEARCH_ITERATIONS:
+            logger.info(f"[DEBUG] Budget de {settings.MAX_RESEARCH_ITERATIONS} passes atteint, fin du workflow.")
+            return "end"
+        if state["context_k"] >= len(state["documents"]) and not self._can_expand(state):
+            logger.info("[DEBUG] Aucun passage supplémentaire disponible, fin du workflow.")
+            return "end"
+        logger.info("[DEBUG] La vérification indique qu'une nouvelle recherche est nécessaire.")
+        return "re_research"
+
+# Workflow compilé une seule fois et partagé par tous les threads
+get_workflow = lazy_singleton(AgentWorkflow)
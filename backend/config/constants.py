@@ -4,5 +4,39 @@ MAX_FILE_SIZE: int = 50 * 1024 * 1024
 # Taille maximale autorisée pour tous les fichiers téléchargés (200 MB)
 MAX_TOTAL_SIZE: int = 200 * 1024 * 1024
 
+# Taille des blocs de lecture pour le hachage et l'encodage base64 en flux (1 MB)
+STREAM_BLOCK_SIZE: int = 1024 * 1024
+
+# Lignes de vecteurs int8 converties en float32 à la fois lors de la recherche (voir NumpyCollections)
+VECTOR_SCORE_BLOCK_ROWS: int = 4096
+
+# Estimation du nombre de caractères par token quand le tokenizer Mistral est indisponible
+CHARS_PER_TOKEN: float = 3.5
+
+# Nombre de chunks embeddés et ajoutés par lot dans une collection
+INDEX_BATCH_SIZE: int = 64
+
+# Première attente (secondes) avant de renvoyer un lot d'embeddings refusé, doublée à chaque tentative
+EMBEDDING_RETRY_BASE_DELAY: float = 1.0
+
+# Métadonnées des scores calibrés (0-1) ajoutées aux chunks par le récupérateur hybride
+BM25_SCORE_KEY: str = "bm25_score"
+VECTOR_SCORE_KEY: str = "vector_score"
+# Score fusionné (RRF ou combinaison convexe) du récupérateur hybride
+HYBRID_SCORE_KEY: str = "hybrid_score"
+# Score du reranker local (lexical 0-1 ou logit du cross-encoder)
+RERANK_SCORE_KEY: str = "rerank_score"
+
+# Constante de lissage de la fusion par rangs réciproques (1 / (RRF_K + rang))
+RRF_K: int = 60
+
+# Métadonnées des chunks enfants: identifiant de la section parente et position dans celle-ci
+# ("start_index" est la clé écrite par les text splitters LangChain)
+PARENT_ID_KEY: str = "parent_id"
+START_INDEX_KEY: str = "start_index"
+
+# Graine des permutations MinHash: les signatures sont comparables d'un processus à l'autre
+MINHASH_SEED: int = 1
+
 # Types de fichiers autorisés pour le téléchargement
 ALLOWED_TYPES: list = [".txt", ".pdf", ".docx", ".md"]
\ No newline at end of file
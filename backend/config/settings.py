@@ -11,6 +11,7 @@ class Settings(BaseSettings):
     MODEL_ID: str = "mistral-large-latest"
     MODEL_OCR_ID: str = "mistral-ocr-latest"
     EMBEDDING_MODEL_ID: str = "mistral-embed"
+    MISTRAL_SERVER_URL: str = "https://api.mistral.ai"
 
     # Tracking LangSmith (si besoin)
     LANGSMITH_API_KEY: str = os.getenv("LANGSMITH_API_KEY")
@@ -23,17 +24,117 @@ class Settings(BaseSettings):
     # Paramètres de base de données
     CHROMA_DB_PATH: str = "./chroma_db"
     CHROMA_COLLECTION_NAME: str = "documents"
+    CHROMA_MAX_DISK_MB: int = 2048
 
-    # Paramètres de récupération
-    VECTOR_SEARCH_K: int = 10
+    # Magasin de vecteurs: "chroma" ou "numpy" (fichiers .npy en memory-map, float32 ou int8)
+    VECTOR_BACKEND: str = "chroma"
+    NUMPY_INDEX_DIR: str = "document_cache/vectors"
+    NUMPY_INDEX_DTYPE: str = "float32"
+
+    # Stockage des sessions: "memory" ou "sqlite" (persistant, partagé entre workers)
+    SESSION_STORE_BACKEND: str = "memory"
+    SESSION_DB_PATH: str = "document_cache/sessions.sqlite3"
+    # Éviction des sessions inactives (secondes), budget mémoire et nombre maximal de sessions
+    SESSION_IDLE_TTL: int = 6 * 3600
+    SESSION_MEMORY_BUDGET_MB: int = 1024
+    MAX_SESSIONS: int = 100
+
+    # Extraction locale: en dessous de ce nombre de caractères, une page PDF est considérée scannée
+    PDF_MIN_TEXT_CHARS: int = 50
+    # OCR par lots de pages, traités en parallèle
+    OCR_BATCH_SIZE: int = 3
+    OCR_MAX_CONCURRENCY: int = 4
+    # Jobs d'ingestion: intervalle minimal (secondes) entre deux indexations des pages déjà OCRisées (0 = désactivé)
+    OCR_PARTIAL_INTERVAL: float = 10.0
+    # Ingestion parallèle: threads par fichier (E/S, OCR) et processus pour l'extraction locale (0 = désactivé)
+    INGEST_MAX_WORKERS: int = 8
+    INGEST_MAX_PROCESSES: int = 2
+    # Jobs d'ingestion en arrière-plan: workers, jobs en attente et historique conservé pour le suivi
+    INGEST_JOB_WORKERS: int = 2
+    INGEST_MAX_PENDING_JOBS: int = 50
+    INGEST_JOB_HISTORY: int = 200
+    # Découpage secondaire après les en-têtes (tokens estimés): sections parentes, chunks enfants
+    # indexés et chevauchement; les sections plus courtes que CHUNK_MIN_TOKENS sont regroupées
+    CHUNK_PARENT_TOKENS: int = 1024
+    CHUNK_TOKENS: int = 256
+    CHUNK_OVERLAP_TOKENS: int = 32
+    CHUNK_MIN_TOKENS: int = 64
+    # Quasi-doublons fusionnés à l'indexation (MinHash + LSH): similarité de Jaccard estimée minimale
+    # (0 = désactivé), permutations de la signature et taille des shingles (octets, 8 au plus)
+    DEDUP_THRESHOLD: float = 0.85
+    DEDUP_NUM_PERM: int = 128
+    DEDUP_SHINGLE_SIZE: int = 5
+
+    # Paramètres de récupération: candidats par signal, puis un seul top-k après fusion des scores
+    VECTOR_SEARCH_K: int = 40
+    BM25_SEARCH_K: int = 40
+    HYBRID_TOP_K: int = 16
+    # Fusion "rrf" (rangs réciproques) ou "convex" (scores normalisés min-max), pondérée (BM25, vecteurs)
+    HYBRID_FUSION: str = "rrf"
     HYBRID_RETRIEVER_WEIGHTS: tuple = (0.4, 0.6)
 
+    # Reclassement local des candidats avant la recherche: "none", "lexical" ou "cross-encoder"
+    # (sentence-transformers); RERANK_CANDIDATES candidats reclassés, RERANK_TOP_N envoyés au LLM
+    RERANKER: str = "none"
+    RERANK_MODEL: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    RERANK_CANDIDATES: int = 40
+    RERANK_TOP_N: int = 4
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_CACHE_SIZE: int = 10000
+
+    # Recherche spéculative: la première passe de recherche démarre en même temps que la vérification
+    # de pertinence (réponse écartée si NO_MATCH)
+    SPECULATIVE_RESEARCH: bool = False
+
+    # Boucle recherche/vérification: nombre maximal de passes, passages initiaux et ajoutés à chaque relance
+    MAX_RESEARCH_ITERATIONS: int = 3
+    RESEARCH_CONTEXT_K: int = 8
+    RESEARCH_CONTEXT_STEP: int = 4
+
+    # Vérification de pertinence: décision sans LLM au-dessus/en dessous de seuils de score calibrés
+    # (BM25 normalisé et similarité cosinus, 0-1); seule la zone intermédiaire est confiée au modèle
+    RELEVANCE_FAST_PATH: bool = True
+    RELEVANCE_BM25_HIGH: float = 0.8
+    RELEVANCE_BM25_LOW: float = 0.15
+    RELEVANCE_VECTOR_HIGH: float = 0.85
+    RELEVANCE_VECTOR_LOW: float = 0.65
+    RELEVANCE_MODEL_ID: str = "mistral-small-latest"
+
+    # Budgets de tokens du contexte par agent, et taille min/max d'un passage dans le contexte
+    RESEARCH_CONTEXT_TOKENS: int = 6000
+    VERIFICATION_CONTEXT_TOKENS: int = 4000
+    RELEVANCE_CONTEXT_TOKENS: int = 1500
+    CONTEXT_MAX_PASSAGE_TOKENS: int = 800
+    CONTEXT_MIN_PASSAGE_TOKENS: int = 48
+
+    # Cache de réponses par ensemble de documents: nombre d'entrées (0 = désactivé), durée de vie (secondes)
+    # et similarité cosinus minimale entre questions
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL: int = 24 * 3600
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+
+    # Embeddings: textes par requête, requêtes simultanées, tentatives sur 429/erreur transitoire
+    # (attente maximale en secondes) et taille du cache LRU des questions
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 5
+    EMBEDDING_RETRY_MAX_WAIT: float = 60.0
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024
+
+    # Pool de connexions HTTP partagé vers l'API Mistral
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_TIMEOUT: float = 120.0
+
     # Paramètres de journalisation
     LOG_LEVEL: str = "INFO"
 
     # Nouveaux paramètres de cache avec annotations de type
     CACHE_DIR: str = "document_cache"
     CACHE_EXPIRE_DAYS: int = 7
+    EMBEDDING_CACHE_DIR: str = "document_cache/embeddings"
+    UPLOAD_DIR: str = "document_cache/uploads"
 
     # Répertoire des exemples
     EXAMPLES_DIR: str = "./static"
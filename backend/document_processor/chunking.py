@@ -0,0 +1,79 @@
+import hashlib
+from typing import List, Tuple
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from ..config import constants
+from ..config.settings import settings
+from ..utils.tokens import estimate_tokens
+
+
+def chunking_signature() -> Tuple[int, int, int, int]:
+    """Paramètres du découpage: des chunks en cache découpés avec d'autres valeurs sont refaits."""
+    return (settings.CHUNK_TOKENS, settings.CHUNK_OVERLAP_TOKENS, settings.CHUNK_PARENT_TOKENS, settings.CHUNK_MIN_TOKENS)
+
+
+def merge_sections(sections: List[Document], headers: List) -> List[Document]:
+    """
+    Regrouper une section trop courte (moins de CHUNK_MIN_TOKENS) avec la suivante du même
+    titre de premier niveau, tant que l'ensemble tient dans CHUNK_TOKENS. Les titres qui
+    diffèrent entre les sections regroupées sont conservés dans le texte.
+    """
+    top = headers[0][1]
+    merged = []
+    for section in sections:
+        last = merged[-1] if merged else None
+        last_tokens = estimate_tokens(last.page_content) if last is not None else 0
+        if (
+            last is not None
+            and last_tokens < settings.CHUNK_MIN_TOKENS
+            and last.metadata.get(top) == section.metadata.get(top)
+            and last_tokens + estimate_tokens(section.page_content) <= settings.CHUNK_TOKENS
+        ):
+            # Titres qui ne seront plus dans les métadonnées communes, conservés dans le texte
+            last_titles = [
+                f"{mark} {last.metadata[name]}" for mark, name in headers
+                if name in last.metadata and section.metadata.get(name) != last.metadata[name]
+            ]
+            titles = [
+                f"{mark} {section.metadata[name]}" for mark, name in headers
+                if name in section.metadata and section.metadata[name] != last.metadata.get(name)
+            ]
+            merged[-1] = Document(
+                page_content="\n\n".join([*last_titles, last.page_content, *titles, section.page_content]),
+                metadata={k: v for k, v in last.metadata.items() if section.metadata.get(k) == v},
+            )
+        else:
+            merged.append(section)
+    return merged
+
+
+def split_sections(sections: List[Document], headers: List) -> List[Document]:
+    """
+    Second découpage des sections Markdown, en tokens estimés: chaque section est découpée en
+    sections parentes d'au plus CHUNK_PARENT_TOKENS, puis chaque parent en chunks enfants de
+    CHUNK_TOKENS avec un chevauchement de CHUNK_OVERLAP_TOKENS. Les enfants (embeddés et indexés)
+    gardent les métadonnées d'en-têtes, l'identifiant de leur parent (PARENT_ID_KEY) et leur
+    position dans le parent (START_INDEX_KEY), qui permettent de reconstituer la section.
+    """
+    parent_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.CHUNK_PARENT_TOKENS, chunk_overlap=0, length_function=estimate_tokens
+    )
+    child_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.CHUNK_TOKENS,
+        chunk_overlap=settings.CHUNK_OVERLAP_TOKENS,
+        length_function=estimate_tokens,
+    )
+    chunks = []
+    for section in merge_sections(sections, headers):
+        for parent in parent_splitter.split_text(section.page_content):
+            parent_id = hashlib.sha256(parent.encode()).hexdigest()
+            # Position cherchée après celle du chunk précédent (add_start_index de LangChain retranche
+            # le chevauchement en tokens d'une position en caractères)
+            start = -1
+            for text in child_splitter.split_text(parent):
+                start = parent.find(text, start + 1)
+                chunks.append(Document(
+                    page_content=text,
+                    metadata={**section.metadata, constants.START_INDEX_KEY: start, constants.PARENT_ID_KEY: parent_id},
+                ))
+    return chunks
@@ -0,0 +1,80 @@
+import io
+import zipfile
+from typing import List, Optional
+from xml.etree import ElementTree
+from pypdf import PdfReader, PdfWriter
+from .file_io import open_binary
+from ..utils.logging import logger
+
+# Espace de noms WordprocessingML des fichiers .docx
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def extract_text(file) -> str:
+    """Lire directement un fichier .txt ou .md (déjà du texte/markdown)."""
+    with open_binary(file) as f:
+        return f.read().decode("utf-8", errors="replace")
+
+
+def _paragraph_text(paragraph) -> str:
+    return "".join(node.text or "" for node in paragraph.iter(f"{W}t"))
+
+
+def extract_docx(file) -> str:
+    """
+    Extraire localement le texte d'un .docx (XML du document, sans dépendance externe).
+    Les titres deviennent des en-têtes markdown et les tableaux des lignes | a | b |.
+    """
+    with open_binary(file) as f, zipfile.ZipFile(f) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+
+    lines = []
+    body = root.find(f"{W}body")
+    for element in body if body is not None else []:
+        if element.tag == f"{W}p":
+            text = _paragraph_text(element).strip()
+            if not text:
+                continue
+            style = element.find(f"{W}pPr/{W}pStyle")
+            style_name = style.get(f"{W}val", "") if style is not None else ""
+            if style_name.lower().replace(" ", "") in {"title", "titre", "heading1", "titre1"}:
+                lines.append(f"# {text}")
+            elif style_name.lower().replace(" ", "") in {"heading2", "titre2"}:
+                lines.append(f"## {text}")
+            else:
+                lines.append(text)
+        elif element.tag == f"{W}tbl":
+            for row in element.iter(f"{W}tr"):
+                cells = [_paragraph_text(cell).strip() for cell in row.iter(f"{W}tc")]
+                lines.append("| " + " | ".join(cells) + " |")
+    return "\n\n".join(lines)
+
+
+def extract_pdf_pages(file) -> Optional[List[str]]:
+    """
+    Extraire la couche texte de chaque page d'un PDF (même approche que PyPDFLoader).
+    Retourne None si pypdf ne peut pas lire le PDF (chiffré, corrompu...).
+    """
+    try:
+        with open_binary(file) as f:
+            reader = PdfReader(f)
+            return [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        logger.warning(f"Couche texte illisible pour {file.name}: {e}")
+        return None
+
+
+def split_pdf(file, pages: List[int]) -> bytes:
+    """
+    Construire avec pypdf un PDF ne contenant que les pages demandées (lots OCR).
+    L'OCR par lots et sa reprise page par page reposent sur cette fonction: pypdf est une
+    dépendance requise, et non une optimisation facultative.
+    """
+    writer = PdfWriter()
+    with open_binary(file) as f:
+        reader = PdfReader(f)
+        for page_no in pages:
+            writer.add_page(reader.pages[page_no])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+    return buffer.getvalue()
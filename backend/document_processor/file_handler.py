@@ -1,156 +1,345 @@
-import os
-import hashlib
-import pickle
 import base64
+import multiprocessing
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List
-from mistralai import Mistral
+from typing import Callable, Dict, List, Optional, Tuple
 from langchain_text_splitters import MarkdownHeaderTextSplitter
+from .file_io import file_digest, file_size, encode_data_url, to_source
+from .extractors import extract_docx, extract_pdf_pages, extract_text, split_pdf
+from .chunking import chunking_signature, split_sections
 from ..config import constants
 from ..config.settings import settings
 from ..utils.logging import logger
+from ..utils.clients import get_mistral_client, lazy_singleton
+
+def split_markdown(markdown: str, headers: List) -> List:
+    """Découper le markdown selon ses en-têtes, puis en chunks de taille bornée (exécuté dans le pool de processus)."""
+    if not markdown.strip():
+        return []
+    splitter = MarkdownHeaderTextSplitter(headers)
+    return split_sections(splitter.split_text(markdown), headers)
+
+def extract_and_split(file, headers: List) -> List:
+    """Extraction locale (.txt/.md/.docx) puis découpage, en une seule tâche CPU."""
+    extension = Path(file.name).suffix.lower()
+    markdown = extract_docx(file) if extension == '.docx' else extract_text(file)
+    return split_markdown(markdown, headers)
 
 class DocumentProcessor:
     def __init__(self):
         self.headers = [("#", "Header 1"), ("##", "Header 2")]
         self.cache_dir = Path(settings.CACHE_DIR)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.client = Mistral(api_key=settings.MISTRALAI_API_KEY)
-        self.batch_size = 3  # Traiter 3 pages à la fois
+        self.client = get_mistral_client()
+        self.batch_size = settings.OCR_BATCH_SIZE  # Pages par requête OCR
+        self.pages_dir = self.cache_dir / "pages"
+        # Borne globale des requêtes OCR simultanées, tous fichiers confondus
+        self._ocr_slots = threading.BoundedSemaphore(settings.OCR_MAX_CONCURRENCY)
+        self._cpu_pool = None
+        self._cpu_pool_lock = threading.Lock()
+
+    def _run_cpu(self, func: Callable, *args):
+        """
+        Exécuter une tâche CPU (extraction locale, découpage) dans le pool de processus partagé,
+        ou dans le thread courant si INGEST_MAX_PROCESSES vaut 0 ou si le pool est indisponible.
+        """
+        if settings.INGEST_MAX_PROCESSES <= 0:
+            return func(*args)
+        with self._cpu_pool_lock:
+            if self._cpu_pool is None:
+                # "spawn": pas de fork d'un serveur multi-threadé (verrous hérités)
+                self._cpu_pool = ProcessPoolExecutor(
+                    max_workers=settings.INGEST_MAX_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            pool = self._cpu_pool
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool as e:
+            logger.warning(f"Pool de processus indisponible, exécution locale: {e}")
+            with self._cpu_pool_lock:
+                if self._cpu_pool is pool:
+                    self._cpu_pool = None
+            return func(*args)
 
     def _validate_files(self, files: List) -> None:
         """Valider la taille totale des fichiers téléchargés."""
-        total_size = 0
-        for f in files:
-            if hasattr(f, 'file_obj'):
-                # Fichier uploadé - utiliser la taille du file_obj
-                f.file_obj.seek(0, 2)  # Aller à la fin
-                total_size += f.file_obj.tell()
-                f.file_obj.seek(0)  # Remettre au début
-            else:
-                # Fichier local - utiliser os.path.getsize
-                total_size += os.path.getsize(f.name)
+        total_size = sum(file_size(f) for f in files)
 
         if total_size > constants.MAX_TOTAL_SIZE:
             raise ValueError(f"La taille totale dépasse la limite de {constants.MAX_TOTAL_SIZE//1024//1024}MB")
 
-    def process(self, files: List) -> List:
-        """Traiter les fichiers avec mise en cache pour les requêtes suivantes"""
+    def process(self, files: List, on_page: Callable = None) -> List:
+        """
+        Traiter les fichiers avec mise en cache pour les requêtes suivantes.
+        Les fichiers sont traités en parallèle (INGEST_MAX_WORKERS threads pour le hachage, le cache
+        et l'OCR; pool de processus pour l'extraction locale et le découpage). Les chunks sont
+        retournés dans l'ordre de la liste: le résultat ne dépend pas de l'ordre de fin des traitements.
+        on_page(file, page_no, markdown) est appelé à chaque page OCRisée, dès que son lot termine.
+        """
         self._validate_files(files)
-        all_chunks = []
-        seen_hashes = set()
-
         logger.info(f"Début du traitement de {len(files)} fichiers")
 
-        for file in files:
-            try:
-                logger.info(f"Traitement du fichier: {file.name}")
-
-                # Générer un hachage basé sur le contenu pour la mise en cache
-                if hasattr(file, 'file_obj'):
-                    # Fichier uploadé - lire depuis file_obj
-                    file.file_obj.seek(0)
-                    content = file.file_obj.read()
-                    file_hash = self._generate_hash(content)
-                else:
-                    # Fichier local - lire depuis le chemin
-                    with open(file.name, "rb") as f:
-                        file_hash = self._generate_hash(f.read())
-                cache_path = self.cache_dir / f"{file_hash}.pkl"
-
-                if self._is_cache_valid(cache_path):
-                    logger.info(f"Chargement depuis le cache: {file.name}")
-                    chunks = self._load_from_cache(cache_path)
-                else:
-                    logger.info(f"Traitement et mise en cache: {file.name}")
-                    chunks = self._process_file(file)
-                    logger.info(f"Chunks générés pour {file.name}: {len(chunks)}")
-
-                    if chunks:
-                        self._save_to_cache(chunks, cache_path)
-                        logger.info(f"Chunks sauvegardés en cache pour {file.name}")
-                    else:
-                        logger.warning(f"Aucun chunk généré pour {file.name}")
-
-                # Dédupliquer les chunks entre les fichiers
-                for chunk in chunks:
-                    chunk_hash = self._generate_hash(chunk.page_content.encode())
-                    if chunk_hash not in seen_hashes:
-                        all_chunks.append(chunk)
-                        seen_hashes.add(chunk_hash)
+        workers = max(1, min(settings.INGEST_MAX_WORKERS, len(files)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda file: self._process_one(file, on_page), files))
 
-            except Exception as e:
-                logger.error(f"Échec du traitement de {file.name}: {str(e)}")
-                continue
+        # Chaque fichier conserve ses propres chunks (même ceux partagés avec un autre fichier):
+        # l'index de la session compte les fichiers propriétaires de chaque chunk, si bien
+        # que retirer un fichier ne supprime pas le contenu qu'il partage avec les autres
+        all_chunks = [chunk for chunks in results for chunk in chunks]
 
-        logger.info(f"Total des chunks uniques: {len(all_chunks)}")
+        logger.info(f"Chunks générés: {len(all_chunks)} (avant dédoublonnage par l'index de la session)")
         return all_chunks
 
-    def _process_file(self, file) -> List:
-        """Logique de traitement avec Mistral OCR"""
-        if not file.name.endswith(('.pdf', '.docx', '.txt', '.md')):
-            logger.warning(f"Ignorer le type de fichier non supporté: {file.name}")
+    def process_file(self, file, on_page: Callable = None, on_partial: Callable = None) -> List:
+        """
+        Traiter un seul fichier (job d'ingestion). Contrairement à process, une erreur de
+        traitement ou un fichier sans aucun chunk lève une exception: le job échoue au lieu
+        de rattacher un fichier vide aux sessions.
+        Pendant l'OCR d'un PDF, on_partial(chunks) reçoit les chunks des pages déjà disponibles
+        (au plus une fois toutes les OCR_PARTIAL_INTERVAL secondes), avant la fin des autres lots.
+        """
+        self._validate_files([file])
+        chunks = self._chunks(file, on_page, on_partial)
+        if not chunks:
+            raise ValueError("Aucun chunk généré: fichier vide, illisible ou non supporté")
+        return chunks
+
+    def _process_one(self, file, on_page: Callable = None) -> List:
+        """Chunks d'un fichier d'un lot ([] en cas d'échec: les autres fichiers sont traités)."""
+        try:
+            return self._chunks(file, on_page)
+        except Exception as e:
+            logger.error(f"Échec du traitement de {file.name}: {str(e)}")
             return []
 
-        # Lire le contenu du fichier en bytes
-        if hasattr(file, 'file_obj'):
-            # Fichier uploadé - lire depuis file_obj
-            file.file_obj.seek(0)
-            file_content = file.file_obj.read()
+    def _chunks(self, file, on_page: Callable = None, on_partial: Callable = None) -> List:
+        """Hachage, cache et extraction d'un fichier; retourne ses chunks."""
+        logger.info(f"Traitement du fichier: {file.name}")
+
+        # Générer un hachage basé sur le contenu pour la mise en cache (lecture en flux)
+        file_hash = file_digest(file)
+        cache_path = self.cache_dir / f"{file_hash}.pkl"
+
+        chunks = self._load_from_cache(cache_path) if self._is_cache_valid(cache_path) else None
+        if chunks is not None:
+            logger.info(f"Chargement depuis le cache: {file.name}")
         else:
-            # Fichier local - lire depuis le chemin
-            with open(file.name, "rb") as f:
-                file_content = f.read()
+            logger.info(f"Traitement et mise en cache: {file.name}")
+            chunks, complete = self._process_file(file, on_page, on_partial)
+            logger.info(f"Chunks générés pour {file.name}: {len(chunks)}")
 
-        logger.info(f"Fichier lu, taille: {len(file_content)} bytes")
+            if chunks and complete:
+                self._save_to_cache(chunks, cache_path)
+                logger.info(f"Chunks sauvegardés en cache pour {file.name}")
+            elif chunks:
+                # Résultat partiel utilisable; seuls les lots échoués seront refaits au prochain essai
+                logger.warning(f"Traitement partiel de {file.name}: chunks non mis en cache")
+            else:
+                logger.warning(f"Aucun chunk généré pour {file.name}")
+
+        # Rattacher chaque chunk à son fichier pour l'index incrémental de la session
+        for chunk in chunks:
+            chunk.metadata["file_hash"] = file_hash
+        return chunks
 
-        # Encoder le contenu en base64
-        file_base64 = base64.b64encode(file_content).decode('utf-8')
+    def _process_file(self, file, on_page: Callable = None, on_partial: Callable = None) -> Tuple[List, bool]:
+        """
+        Extraire le markdown du fichier puis le découper en chunks.
+        Les .txt/.md sont lus directement, les .docx extraits localement et les PDF utilisent
+        leur couche texte; seules les pages scannées (sans texte) partent à Mistral OCR.
+        Retourne les chunks et un indicateur: False si des pages n'ont pas pu être OCRisées.
+        """
+        extension = Path(file.name).suffix.lower()
+        if extension not in ('.pdf', '.docx', '.txt', '.md'):
+            logger.warning(f"Ignorer le type de fichier non supporté: {file.name}")
+            return [], True
+
+        logger.info(f"Fichier lu, taille: {file_size(file)} bytes")
 
-        # Traiter le document entier d'un coup
         try:
+            if extension != '.pdf':
+                with self._source(file) as source:
+                    return self._run_cpu(extract_and_split, source, self.headers), True
+            markdown, complete = self._process_pdf(file, on_page, on_partial)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'extraction de {file.name}: {str(e)}")
+            raise
+
+        return self._run_cpu(split_markdown, markdown, self.headers), complete
+
+    @contextmanager
+    def _source(self, file):
+        """Fichier à transmettre au pool de processus (les uploads Django ne sont pas sérialisables)."""
+        if settings.INGEST_MAX_PROCESSES <= 0:
+            yield file
+        else:
+            with to_source(file) as source:
+                yield source
+
+    def _process_pdf(self, file, on_page: Callable = None, on_partial: Callable = None) -> Tuple[str, bool]:
+        """Couche texte des pages numériques + OCR des seules pages scannées."""
+        with self._source(file) as source:
+            pages = self._run_cpu(extract_pdf_pages, source)
+        if pages is None:
+            logger.warning(f"PDF illisible par pypdf, OCR du document entier: {file.name}")
+            ocr_pages = self._ocr(file, on_page=on_page)
+            return "\n\n".join(ocr_pages[i] for i in sorted(ocr_pages)), bool(ocr_pages)
+
+        scanned = [i for i, text in enumerate(pages) if len(text.strip()) < settings.PDF_MIN_TEXT_CHARS]
+        logger.info(f"PDF de {len(pages)} pages: {len(pages) - len(scanned)} avec couche texte, {len(scanned)} à OCRiser")
+        on_batch = self._partial_chunks(file, pages, on_partial) if on_partial is not None else None
+        ocr_pages = self._ocr(file, scanned, on_page, on_batch) if scanned else {}
+        for i in scanned:
+            pages[i] = ocr_pages.get(i, pages[i])
+        return "\n\n".join(pages), len(ocr_pages) == len(scanned)
+
+    def _partial_chunks(self, file, pages: List[str], on_partial: Callable) -> Optional[Callable]:
+        """
+        Rappel de fin de lot OCR: découpe les pages disponibles (couche texte et pages déjà
+        OCRisées) et transmet leurs chunks à on_partial, au plus une fois toutes les
+        OCR_PARTIAL_INTERVAL secondes. Une erreur d'indexation partielle n'interrompt pas l'OCR.
+        """
+        if settings.OCR_PARTIAL_INTERVAL <= 0:
+            return None
+        file_hash = file_digest(file)
+        last = time.monotonic()
+
+        def on_batch(ocr_pages: Dict[int, str]) -> None:
+            nonlocal last
+            if time.monotonic() - last < settings.OCR_PARTIAL_INTERVAL:
+                return
+            markdown = "\n\n".join(ocr_pages.get(i, text) for i, text in enumerate(pages))
+            try:
+                chunks = self._run_cpu(split_markdown, markdown, self.headers)
+                for chunk in chunks:
+                    chunk.metadata["file_hash"] = file_hash
+                on_partial(chunks)
+                logger.info(f"Résultat partiel de {file.name}: {len(ocr_pages)} pages OCRisées, {len(chunks)} chunks")
+            except Exception as e:
+                logger.error(f"Erreur lors de l'indexation partielle de {file.name}: {str(e)}")
+            last = time.monotonic()
+
+        return on_batch
+
+    def _ocr(self, file, pages: List[int] = None, on_page: Callable = None, on_batch: Callable = None) -> Dict[int, str]:
+        """
+        OCRiser les pages demandées par lots de batch_size, en parallèle (OCR_MAX_CONCURRENCY).
+        Chaque page est mise en cache sous (file_hash, page_no): un nouvel essai ne refait que
+        les lots échoués. Les lots sont extraits avec pypdf (voir split_pdf); sans liste de pages
+        (PDF que pypdf ne sait pas lire), le document est envoyé en une seule requête et le cache
+        par page ne sert pas à la reprise. on_batch(pages OCRisées) est appelé à la fin de chaque
+        lot, sauf le dernier. Retourne le markdown par numéro de page (éventuellement partiel).
+        """
+        file_hash = file_digest(file)
+        if pages is None:
+            logger.warning(f"OCR de {file.name} en une seule requête, sans découpage en lots ni reprise par page")
+            batches = [None]
+            result = {}
+        else:
+            result = {p: md for p in pages if (md := self._load_page(file_hash, p)) is not None}
+            todo = [p for p in pages if p not in result]
+            if result:
+                logger.info(f"{len(result)} pages chargées depuis le cache OCR, {len(todo)} à traiter")
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+
+        # Chaque lot ouvre son propre descripteur sur une copie disque: un upload en mémoire
+        # partagé entre threads serait repositionné (seek) pendant la lecture d'un autre lot
+        with to_source(file) as source, ThreadPoolExecutor(max_workers=settings.OCR_MAX_CONCURRENCY) as executor:
+            futures = {executor.submit(self._ocr_batch, source, batch): batch for batch in batches}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    batch_pages = future.result()
+                except Exception as e:
+                    logger.error(f"Erreur lors du traitement OCR des pages {futures[future]}: {str(e)}")
+                    continue
+                for page_no, markdown in batch_pages.items():
+                    self._save_page(file_hash, page_no, markdown)
+                    result[page_no] = markdown
+                    if on_page is not None:
+                        on_page(file, page_no, markdown)
+                if on_batch is not None and done < len(futures):
+                    on_batch(result)
+
+        logger.info(f"Document traité avec {len(result)} pages OCR")
+        return result
+
+    def _ocr_batch(self, file, batch: Optional[List[int]]) -> Dict[int, str]:
+        """Une requête Mistral OCR (sans images) pour un lot de pages, ou le document entier."""
+        if batch is None:
+            # Encoder le contenu en base64 par blocs, sans copie intermédiaire du fichier
+            document_url = encode_data_url(file, "application/pdf")
+        else:
+            # N'envoyer que les pages du lot, extraites dans un PDF réduit
+            sub_pdf = split_pdf(file, batch)
+            document_url = f"data:application/pdf;base64,{base64.b64encode(sub_pdf).decode('ascii')}"
+
+        with self._ocr_slots:
             response = self.client.ocr.process(
                 model=settings.MODEL_OCR_ID,
                 document={
                     "type": "document_url",
-                    "document_url": f"data:application/pdf;base64,{file_base64}"
+                    "document_url": document_url
                 },
-                include_image_base64=True
+                include_image_base64=False
             )
+        if batch is None:
+            return {page.index: page.markdown for page in response.pages}
+        return {batch[page.index]: page.markdown for page in response.pages if page.index < len(batch)}
 
-            total_pages = len(response.pages)
-            logger.info(f"Document traité avec {total_pages} pages")
+    def _page_path(self, file_hash: str, page_no: int) -> Path:
+        return self.pages_dir / file_hash / f"{page_no}.md"
 
-            # Collecter tout le markdown
-            all_markdown = [page.markdown for page in response.pages]
+    def _load_page(self, file_hash: str, page_no: int) -> Optional[str]:
+        page_path = self._page_path(file_hash, page_no)
+        if not self._is_cache_valid(page_path):
+            return None
+        return page_path.read_text(encoding="utf-8")
 
-            # Assembler le markdown et créer les chunks
-            markdown = "\n\n".join(all_markdown)
-            splitter = MarkdownHeaderTextSplitter(self.headers)
-            return splitter.split_text(markdown)
+    def _save_page(self, file_hash: str, page_no: int, markdown: str) -> None:
+        page_path = self._page_path(file_hash, page_no)
+        page_path.parent.mkdir(parents=True, exist_ok=True)
+        page_path.write_text(markdown, encoding="utf-8")
 
-        except Exception as e:
-            logger.error(f"Erreur lors du traitement OCR: {str(e)}")
-            return []
-
-    def _generate_hash(self, content: bytes) -> str:
-        return hashlib.sha256(content).hexdigest()
+    def load_cached_chunks(self, file_hash: str) -> List:
+        """Recharger les chunks d'un fichier déjà traité (réhydratation de session), ou None."""
+        cache_path = self.cache_dir / f"{file_hash}.pkl"
+        if not self._is_cache_valid(cache_path):
+            return None
+        chunks = self._load_from_cache(cache_path)
+        if chunks is None:
+            return None
+        for chunk in chunks:
+            chunk.metadata["file_hash"] = file_hash
+        return chunks
 
     def _save_to_cache(self, chunks: List, cache_path: Path):
         with open(cache_path, "wb") as f:
             pickle.dump({
                 "timestamp": datetime.now().timestamp(),
+                "chunking": chunking_signature(),
                 "chunks": chunks
             }, f)
 
-    def _load_from_cache(self, cache_path: Path) -> List:
+    def _load_from_cache(self, cache_path: Path) -> Optional[List]:
+        """Chunks en cache, ou None s'ils ont été découpés avec d'autres paramètres."""
         with open(cache_path, "rb") as f:
             data = pickle.load(f)
+        if data.get("chunking") != chunking_signature():
+            return None
         return data["chunks"]
 
     def _is_cache_valid(self, cache_path: Path) -> bool:
         if not cache_path.exists():
             return False
         cache_age = datetime.now() - datetime.fromtimestamp(cache_path.stat().st_mtime)
-        return cache_age < timedelta(days=settings.CACHE_EXPIRE_DAYS)
\ No newline at end of file
+        return cache_age < timedelta(days=settings.CACHE_EXPIRE_DAYS)
+
+get_document_processor = lazy_singleton(DocumentProcessor)
@@ -0,0 +1,87 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from ..config import constants
+
+@contextmanager
+def open_binary(file):
+    """Ouvrir un fichier uploadé (file_obj) ou local en lecture binaire, positionné au début."""
+    if hasattr(file, 'file_obj'):
+        file.file_obj.seek(0)
+        yield file.file_obj
+        file.file_obj.seek(0)
+    else:
+        with open(file.name, "rb") as f:
+            yield f
+
+def file_digest(file) -> str:
+    """
+    SHA-256 du fichier calculé en un seul passage par blocs de taille fixe.
+    Le résultat est mémorisé sur l'objet fichier (attribut file_hash) pour les étapes suivantes.
+    """
+    digest = getattr(file, 'file_hash', None)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open_binary(file) as f:
+            for block in iter(lambda: f.read(constants.STREAM_BLOCK_SIZE), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+        file.file_hash = digest
+    return digest
+
+def file_size(file) -> int:
+    if hasattr(file, 'file_obj'):
+        file.file_obj.seek(0, 2)
+        size = file.file_obj.tell()
+        file.file_obj.seek(0)
+        return size
+    return os.path.getsize(file.name)
+
+def encode_data_url(file, mime_type: str) -> str:
+    """
+    Construire l'URL data:...;base64 du fichier en encodant par blocs (multiples de 3 octets)
+    directement dans un tampon préalloué: le contenu brut n'est jamais chargé en entier.
+    """
+    prefix = f"data:{mime_type};base64,".encode()
+    size = file_size(file)
+    buffer = bytearray(len(prefix) + 4 * ((size + 2) // 3))
+    buffer[:len(prefix)] = prefix
+    position = len(prefix)
+    block_size = constants.STREAM_BLOCK_SIZE - constants.STREAM_BLOCK_SIZE % 3
+    with open_binary(file) as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            encoded = base64.b64encode(block)
+            buffer[position:position + len(encoded)] = encoded
+            position += len(encoded)
+    del buffer[position:]
+    return buffer.decode('ascii')
+
+class FileSource:
+    """Fichier local désigné par son chemin, transmissible à un autre processus qui l'ouvre lui-même."""
+    def __init__(self, name: str):
+        self.name = name
+
+@contextmanager
+def to_source(file):
+    """
+    Copie transmissible au pool de processus: un chemin sur disque, jamais le contenu sérialisé.
+    Un upload Django déjà écrit sur disque (TemporaryUploadedFile) est transmis tel quel; un upload
+    en mémoire est copié par blocs dans un fichier temporaire, supprimé à la sortie du bloc.
+    """
+    if not hasattr(file, 'file_obj'):
+        yield FileSource(file.name)
+        return
+    temporary_file_path = getattr(file.file_obj, 'temporary_file_path', None)
+    if temporary_file_path is not None:
+        yield FileSource(temporary_file_path())
+        return
+    with open_binary(file) as src, tempfile.NamedTemporaryFile(suffix=Path(file.name).suffix.lower(), delete=False) as dst:
+        shutil.copyfileobj(src, dst, constants.STREAM_BLOCK_SIZE)
+    try:
+        yield FileSource(dst.name)
+    finally:
+        os.unlink(dst.name)
@@ -0,0 +1,188 @@
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from .file_io import FileSource, file_digest, open_binary
+from ..config import constants
+from ..config.settings import settings
+from ..utils.logging import logger
+
+
+class IngestionJob:
+    """
+    Ingestion en arrière-plan d'un fichier (OCR -> découpage -> embedding -> indexation).
+    Un même fichier téléchargé en parallèle par plusieurs sessions partage un seul job:
+    chaque session est rattachée à l'index quand le traitement est terminé. Pendant l'OCR
+    d'un PDF, les pages déjà traitées sont indexées progressivement dans les sessions du job.
+    """
+
+    def __init__(self, file_hash: str, file_name: str, session_id: str):
+        self.id = uuid.uuid4().hex
+        self.file_hash = file_hash
+        self.file_name = file_name
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.stages = {
+            "ocr": {"pages": 0},
+            "split": {"chunks": 0},
+            "embedding": {"done": 0, "total": 0},
+            "indexing": {"sessions": 0, "partial": 0},
+        }
+        self._sessions = [session_id]
+        self._attached = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def join(self, session_id: str) -> bool:
+        """Rattacher une session au job; False si le job ne rattache plus de sessions."""
+        with self._lock:
+            if self._closed:
+                return False
+            if session_id not in self._sessions:
+                self._sessions.append(session_id)
+            return True
+
+    def sessions(self) -> List[str]:
+        """Sessions rattachées au job jusqu'ici."""
+        with self._lock:
+            return list(self._sessions)
+
+    def next_session(self) -> Optional[str]:
+        """Prochaine session à indexer, ou None (le job n'accepte alors plus de sessions)."""
+        with self._lock:
+            if self._attached < len(self._sessions):
+                self._attached += 1
+                return self._sessions[self._attached - 1]
+            self._closed = True
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+
+    def update(self, stage: str, **values) -> None:
+        with self._lock:
+            self.stages[stage].update(values)
+
+    def advance(self, stage: str, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stages[stage][key] += n
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "file_name": self.file_name,
+                "file_hash": self.file_hash,
+                "status": self.status,
+                "error": self.error,
+                "sessions": list(self._sessions),
+                "stages": {stage: dict(values) for stage, values in self.stages.items()},
+                "elapsed": round((self.finished_at or time.time()) - self.created_at, 2),
+            }
+
+
+class IngestionQueue:
+    """
+    File d'ingestion bornée: INGEST_JOB_WORKERS jobs s'exécutent en parallèle, au plus
+    INGEST_MAX_PENDING_JOBS sont en attente. Les jobs sont dédupliqués par hash de fichier.
+    Les fichiers uploadés sont copiés sur disque, la requête Django pouvant se terminer avant le job.
+    """
+
+    def __init__(self, run: Callable[[IngestionJob, object], None], upload_dir: str = None):
+        self.run = run
+        self.upload_dir = Path(upload_dir or settings.UPLOAD_DIR)
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=settings.INGEST_JOB_WORKERS, thread_name_prefix="ingestion")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._active: Dict[str, IngestionJob] = {}
+
+    def submit(self, file, session_id: str) -> IngestionJob:
+        """Créer (ou rejoindre) le job d'ingestion du fichier pour la session."""
+        return self.submit_many([file], session_id)[0]
+
+    def submit_many(self, files: List, session_id: str) -> List[IngestionJob]:
+        """
+        Créer (ou rejoindre) les jobs d'ingestion d'un lot de fichiers pour la session.
+        La capacité de la file est vérifiée pour tout le lot avant de créer le moindre job:
+        si elle est dépassée, aucun fichier n'est accepté.
+        """
+        hashes = [file_digest(file) for file in files]
+        jobs, created = [], []
+        with self._lock:
+            new = {h for h in hashes if h not in self._active}
+            pending = sum(1 for j in self._active.values() if j.status == "queued")
+            if new and pending + len(new) > settings.INGEST_MAX_PENDING_JOBS:
+                raise RuntimeError("File d'ingestion pleine, réessayez plus tard.")
+            for file, file_hash in zip(files, hashes):
+                job = self._active.get(file_hash)
+                if job is not None and job.join(session_id):
+                    logger.info(f"Job {job.id} partagé pour {file.name} (session {session_id})")
+                    jobs.append(job)
+                    continue
+                job = IngestionJob(file_hash, Path(file.name).name, session_id)
+                self._active[file_hash] = job
+                self._jobs[job.id] = job
+                jobs.append(job)
+                created.append((job, file))
+
+        for i, (job, file) in enumerate(created):
+            if hasattr(file, 'file_obj'):
+                try:
+                    file = self._spool(file, job)
+                except Exception:
+                    # Les jobs du lot pas encore lancés sont abandonnés
+                    with self._lock:
+                        for dropped, _ in created[i:]:
+                            if self._active.get(dropped.file_hash) is dropped:
+                                del self._active[dropped.file_hash]
+                            self._jobs.pop(dropped.id, None)
+                    raise
+            self._executor.submit(self._run, job, file)
+            logger.info(f"Job {job.id} créé pour {file.name} (session {session_id})")
+        return jobs
+
+    def _spool(self, file, job: IngestionJob) -> FileSource:
+        path = self.upload_dir / f"{job.id}{Path(file.name).suffix.lower()}"
+        with open_binary(file) as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, constants.STREAM_BLOCK_SIZE)
+        spooled = FileSource(str(path))
+        spooled.file_hash = job.file_hash
+        spooled.spooled = True
+        return spooled
+
+    def _run(self, job: IngestionJob, file) -> None:
+        job.status = "running"
+        try:
+            self.run(job, file)
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"Échec du job {job.id} ({job.file_name}): {str(e)}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.close()  # Plus aucune session ne peut rejoindre ce job
+            job.finished_at = time.time()
+            if getattr(file, 'spooled', False):
+                Path(file.name).unlink(missing_ok=True)
+            with self._lock:
+                if self._active.get(job.file_hash) is job:
+                    del self._active[job.file_hash]
+                self._prune()
+
+    def _prune(self) -> None:
+        """Ne conserver que les INGEST_JOB_HISTORY derniers jobs terminés."""
+        finished = [jid for jid, j in self._jobs.items() if j.finished_at is not None]
+        for jid in finished[:max(0, len(finished) - settings.INGEST_JOB_HISTORY)]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
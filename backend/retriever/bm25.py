@@ -0,0 +1,138 @@
+import os
+import re
+import unicodedata
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+from ..utils.logging import logger
+
+# Version de l'analyseur: un index persisté avec une autre version est reconstruit
+ANALYZER_VERSION = 1
+
+# Mots vides français (sans accents, comme les termes analysés)
+FRENCH_STOPWORDS = frozenset("""
+    a afin ai aie aient ainsi alors au aucun aucune aupres auquel aura aurait aussi autre autres aux auxquels avait avant
+    avec avoir ayant c ca car ce ceci cela celle celles celui cependant ces cet cette ceux chaque chez ci comme comment
+    combien d dans de des desquels deux devrait dois doit donc dont du duquel elle elles en encore entre est et etaient
+    etait etant ete etre eu eux fait faire font hors ici il ils j je jusqu l la laquelle le lequel les lesquels leur leurs
+    lors lorsque lui m ma mais me meme memes mes moi moins mon n ne ni non nos notre nous on ont or ou par parce pas
+    peu peut plus pour pourquoi quand que quel quelle quelles quels qui quoi s sa sans se selon ses si sien soit son
+    sont sous sur t ta te tes toi ton tous tout toute toutes tres tu un une unes uns vers via vos votre vous y
+""".split())
+
+
+def fold(text: str) -> str:
+    """Minuscules sans accents ("Société" -> "societe")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(word: str) -> str:
+    """
+    Racinisation française minimale (d'après Savoy): pluriel, puis pour les mots d'au moins
+    5 lettres infinitif en -er, e final et consonne doublée. Les nombres sont conservés.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("aux") and len(word) > 4:
+        # "journaux" -> "journal"
+        return word[:-3] + "al"
+    if word[-1] in "sx":
+        word = word[:-1]
+    if len(word) < 5:
+        return word
+    if word.endswith("r"):
+        word = word[:-1]
+    if word.endswith("e"):
+        word = word[:-1]
+    if word[-1] == word[-2] and word[-1].isalpha():
+        word = word[:-1]
+    return word
+
+
+def analyze(text: str) -> List[str]:
+    """Termes indexés d'un texte: repli des accents, mots vides retirés, racinisation."""
+    return [stem(token) for token in re.findall(r"[a-z0-9]+", fold(text)) if token not in FRENCH_STOPWORDS]
+
+
+class DocumentTerms:
+    """
+    Index BM25 d'un document (hash du fichier), en tableaux NumPy compacts au format CSR:
+    pour le i-ème terme du vocabulaire trié, postings[indptr[i]:indptr[i+1]] sont les lignes
+    des chunks qui le contiennent et tfs leurs fréquences. Persisté une fois par document,
+    il n'est plus jamais retokenisé.
+    """
+
+    def __init__(self, ids: np.ndarray, vocab: np.ndarray, indptr: np.ndarray,
+                 postings: np.ndarray, tfs: np.ndarray, lengths: np.ndarray):
+        self.ids = ids
+        self.vocab = vocab
+        self.indptr = indptr
+        self.postings = postings
+        self.tfs = tfs
+        self.lengths = lengths
+
+    @classmethod
+    def build(cls, ids: List[str], texts: List[str]) -> "DocumentTerms":
+        counts = [Counter(analyze(text)) for text in texts]
+        vocab = sorted(set().union(*counts)) if counts else []
+        term_index = {term: i for i, term in enumerate(vocab)}
+
+        terms, rows, tfs = [], [], []
+        for row, counter in enumerate(counts):
+            for term, tf in counter.items():
+                terms.append(term_index[term])
+                rows.append(row)
+                tfs.append(tf)
+        terms = np.asarray(terms, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=indptr[1:])
+
+        return cls(
+            ids=np.asarray(ids, dtype=str),
+            vocab=np.asarray(vocab, dtype=str),
+            indptr=indptr,
+            postings=np.asarray(rows, dtype=np.int32)[order],
+            tfs=np.asarray(tfs, dtype=np.float32)[order],
+            lengths=np.asarray([sum(c.values()) for c in counts], dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["DocumentTerms"]:
+        """Index persisté, ou None s'il est absent, illisible ou d'une autre version de l'analyseur."""
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != ANALYZER_VERSION:
+                    return None
+                return cls(data["ids"], data["vocab"], data["indptr"], data["postings"], data["tfs"], data["lengths"])
+        except Exception as e:
+            logger.warning(f"Index BM25 illisible ({path.name}): {e}")
+            return None
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f, version=np.array(ANALYZER_VERSION), ids=self.ids, vocab=self.vocab, indptr=self.indptr,
+                postings=self.postings, tfs=self.tfs, lengths=self.lengths,
+            )
+        os.replace(tmp, path)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def lookup(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Lignes des chunks contenant le terme et fréquences (recherche dichotomique dans le vocabulaire)."""
+        i = int(np.searchsorted(self.vocab, term))
+        if i == len(self.vocab) or self.vocab[i] != term:
+            return self.postings[:0], self.tfs[:0]
+        return self.postings[self.indptr[i]:self.indptr[i + 1]], self.tfs[self.indptr[i]:self.indptr[i + 1]]
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.ids, self.vocab, self.indptr, self.postings, self.tfs, self.lengths))
@@ -1,10 +1,12 @@
 import os
-from langchain_community.vectorstores import Chroma
-from langchain_mistralai import MistralAIEmbeddings
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
+from .dedup import NearDuplicateStats
+from .hybrid_index import HybridIndex
+from .embedding_cache import CachedEmbeddings
+from .numpy_store import NumpyCollections
+from .vector_store import DocumentCollections
 from ..config.settings import settings
 from ..utils.logging import logger
+from ..utils.clients import get_embeddings, lazy_singleton
 
 hf_token = os.environ.get("HF_TOKEN")
 if hf_token:
@@ -12,50 +14,30 @@ if hf_token:
 
 class RetrieverBuilder:
     def __init__(self):
-        """Initialiser le constructeur de récupérateur avec les embeddings."""
-
-        embedding = MistralAIEmbeddings(
-            model=settings.EMBEDDING_MODEL_ID,
-            api_key=settings.MISTRALAI_API_KEY,
-        )
-        self.embeddings = embedding
-
-    def build_hybrid_retriever(self, docs):
-        """Construire un récupérateur hybride utilisant BM25 et la récupération basée sur les vecteurs."""
+        """Initialiser le constructeur de récupérateur avec les embeddings (mis en cache par contenu)."""
+        self.embeddings = CachedEmbeddings(get_embeddings())
+        # Quasi-doublons fusionnés, tous index de session confondus
+        self.dedup_stats = NearDuplicateStats()
         try:
-            # Créer le récupérateur BM25 d'abord
-            bm25 = BM25Retriever.from_documents(docs)
-            logger.info("Récupérateur BM25 créé avec succès.")
-
-            try:
-                vector_store = Chroma.from_documents(
-                    documents=docs,
-                    embedding=self.embeddings,
-                    persist_directory=settings.CHROMA_DB_PATH
-                )
-                logger.info("Magasin de vecteurs créé avec succès.")
-
-                # Créer le récupérateur basé sur les vecteurs
-                vector_retriever = vector_store.as_retriever(search_kwargs={"k": settings.VECTOR_SEARCH_K})
-                logger.info("Récupérateur de vecteurs créé avec succès.")
-
-                # Combiner les récupérateurs en un récupérateur hybride
-                weights = settings.HYBRID_RETRIEVER_WEIGHTS
-                if len(weights) != 2:
-                    logger.warning(f"Poids incorrects: {weights}, utilisation des poids par défaut")
-                    weights = [0.4, 0.6]
-
-                hybrid_retriever = EnsembleRetriever(
-                    retrievers=[bm25, vector_retriever],
-                    weights=weights
-                )
-                logger.info("Récupérateur hybride créé avec succès.")
-                return hybrid_retriever
-            except Exception as e:
-                logger.warning(f"Erreur lors de la création du magasin de vecteurs: {e}")
-                logger.info("Utilisation du récupérateur BM25 uniquement.")
-                return bm25
+            if settings.VECTOR_BACKEND == "numpy":
+                self.collections = NumpyCollections(self.embeddings)
+            else:
+                self.collections = DocumentCollections(self.embeddings)
+            logger.info("Magasin de vecteurs créé avec succès.")
+        except Exception as e:
+            logger.warning(f"Erreur lors de la création du magasin de vecteurs: {e}")
+            self.collections = None
 
+    def build_hybrid_index(self, session_id: str, docs=None) -> HybridIndex:
+        """Construire l'index hybride incrémental (BM25 + vecteurs) d'une session."""
+        try:
+            index = HybridIndex(session_id, self.collections, self.dedup_stats)
+            if docs:
+                index.add_documents(docs)
+            logger.info("Récupérateur hybride créé avec succès.")
+            return index
         except Exception as e:
             logger.error(f"Échec de la construction du récupérateur hybride: {e}")
-            raise
\ No newline at end of file
+            raise
+
+get_retriever_builder = lazy_singleton(RetrieverBuilder)
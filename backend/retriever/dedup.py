@@ -0,0 +1,146 @@
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+import numpy as np
+from langchain.schema import Document
+from .bm25 import fold
+from ..config import constants
+from ..config.settings import settings
+
+
+def shingles(text: str, size: int) -> np.ndarray:
+    """
+    Shingles d'octets du texte normalisé (minuscules sans accents, espaces réduits), chacun
+    encodé exactement dans un entier 64 bits (size <= 8): pas de collision de hachage.
+    """
+    data = np.frombuffer(" ".join(fold(text).split()).encode(), dtype=np.uint8).astype(np.uint64)
+    if len(data) < size:
+        data = np.pad(data, (0, size - len(data)))
+    windows = np.lib.stride_tricks.sliding_window_view(data, size)
+    packed = np.zeros(len(windows), dtype=np.uint64)
+    for j in range(size):
+        packed |= windows[:, j] << np.uint64(8 * j)
+    return np.unique(packed)
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Découpage de la signature en bandes (bands x rows = num_perm) qui minimise la somme des
+    probabilités de faux positifs (sous le seuil) et de faux négatifs (au-dessus), comme datasketch.
+    """
+    s = np.linspace(0, 1, 1001)
+    best, best_error = (num_perm, 1), float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        candidate = 1 - (1 - s ** rows) ** bands
+        error = candidate[s < threshold].sum() + (1 - candidate[s >= threshold]).sum()
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def _numbers(text: str) -> Tuple[str, ...]:
+    # Deux clauses identiques à un montant près ne sont pas des doublons
+    return tuple(sorted(re.findall(r"\d+", text)))
+
+
+class NearDuplicateStats:
+    """Compteurs partagés par les index des sessions: chunks examinés, fusionnés et caractères évités."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.merged = 0
+        self.chars_removed = 0
+
+    def record(self, chunks: int, merged: int, chars_removed: int) -> None:
+        with self._lock:
+            self.chunks += chunks
+            self.merged += merged
+            self.chars_removed += chars_removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "merged": self.merged,
+                "merged_rate": self.merged / self.chunks if self.chunks else 0.0,
+                "chars_removed": self.chars_removed,
+            }
+
+
+class NearDuplicateIndex:
+    """
+    Index MinHash + LSH des chunks d'une session. Un chunk dont la similarité de Jaccard estimée
+    (shingles de DEDUP_SHINGLE_SIZE octets) avec un chunk déjà indexé atteint DEDUP_THRESHOLD,
+    et qui cite les mêmes nombres, est un quasi-doublon (en-têtes, pieds de page, clauses types,
+    variantes d'OCR): il est remplacé par ce représentant au lieu d'être embeddé et indexé.
+    """
+
+    def __init__(self, threshold: float = None, num_perm: int = None, shingle_size: int = None,
+                 stats: NearDuplicateStats = None):
+        self.threshold = settings.DEDUP_THRESHOLD if threshold is None else threshold
+        self.num_perm = num_perm or settings.DEDUP_NUM_PERM
+        self.shingle_size = min(shingle_size or settings.DEDUP_SHINGLE_SIZE, 8)
+        self.bands, self.rows = lsh_bands(self.num_perm, self.threshold)
+        rng = np.random.default_rng(constants.MINHASH_SEED)
+        # Hachage multiplicatif (a * x + b) mod 2^64, 32 bits de poids fort; a impair
+        self._a = rng.integers(0, 2 ** 63, self.num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, self.num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._docs: Dict[str, Document] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = defaultdict(set)
+        self.counters = stats or NearDuplicateStats()
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.threshold < 1
+
+    def signature(self, text: str) -> np.ndarray:
+        values = shingles(text, self.shingle_size)
+        return ((self._a[:, None] * values[None, :] + self._b[:, None]) >> np.uint64(32)).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray):
+        return [(i, signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    def find_or_add(self, cid: str, doc: Document) -> Optional[Document]:
+        """Représentant du chunk s'il est un quasi-doublon d'un chunk indexé; sinon l'indexer et retourner None."""
+        signature = self.signature(doc.page_content)
+        keys = self._band_keys(signature)
+        numbers = _numbers(doc.page_content)
+        with self._lock:
+            candidates = set().union(*(self._buckets.get(key, ()) for key in keys)) - {cid}
+            best, best_similarity = None, self.threshold
+            for candidate in candidates:
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= best_similarity and _numbers(self._docs[candidate].page_content) == numbers:
+                    best, best_similarity = candidate, similarity
+            if best is not None:
+                return self._docs[best]
+            self._signatures[cid] = signature
+            self._docs[cid] = doc
+            for key in keys:
+                self._buckets[key].add(cid)
+            return None
+
+    def remove(self, cid: str) -> None:
+        with self._lock:
+            signature = self._signatures.pop(cid, None)
+            self._docs.pop(cid, None)
+            if signature is None:
+                return
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(cid)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def memory_usage(self) -> int:
+        """Estimation (octets) des signatures (les chunks sont comptés par l'index BM25)."""
+        with self._lock:
+            return len(self._signatures) * self.num_perm * 8
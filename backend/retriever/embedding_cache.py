@@ -0,0 +1,262 @@
+import fcntl
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import httpx
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from tenacity import RetryError
+from ..config import constants
+from ..config.settings import settings
+from ..utils.logging import logger
+
+
+class EmbeddingStore:
+    """
+    Stockage persistant des embeddings adressé par contenu.
+    Les vecteurs sont ajoutés à la suite dans un fichier float32 brut (lu en memory-map)
+    et la clé de chaque ligne dans un fichier texte parallèle.
+    """
+
+    def __init__(self, directory: str, model_id: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.model_id = model_id
+        self.vectors_path = self.directory / f"{model_id}.f32"
+        self.keys_path = self.directory / f"{model_id}.keys"
+        self.meta_path = self.directory / f"{model_id}.json"
+        self.vectors_path.touch(exist_ok=True)
+        self.keys_path.touch(exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._rows: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._line_count = 0
+        self._dim: Optional[int] = None
+        self._mmap = None
+        self._mapped_rows = 0
+        self._sync()
+
+    def key(self, text: str) -> str:
+        """Clé SHA-256 du texte du chunk et de l'identifiant du modèle."""
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _sync(self) -> None:
+        """Relire les clés ajoutées depuis la dernière lecture (par ce processus ou un autre)."""
+        if self._dim is None and self.meta_path.exists():
+            self._dim = json.loads(self.meta_path.read_text())["dim"]
+        if self.keys_path.stat().st_size == self._keys_offset:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        # Ignorer une éventuelle ligne incomplète (écriture en cours)
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            self._rows.setdefault(line.decode(), self._line_count)
+            self._line_count += 1
+        self._keys_offset += len(complete)
+
+    def _vectors(self) -> np.ndarray:
+        """Vue memory-map des vecteurs, remappée quand le fichier a grandi."""
+        if self._mmap is None or self._mapped_rows < self._line_count:
+            rows = os.path.getsize(self.vectors_path) // (4 * self._dim)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim)) if rows else None
+            self._mapped_rows = rows
+        return self._mmap
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Retourner le vecteur de chaque clé, ou None s'il n'est pas en cache."""
+        with self._lock:
+            if any(k not in self._rows for k in keys):
+                self._sync()
+            if self._dim is None:
+                return [None] * len(keys)
+            vectors = self._vectors()
+            result = []
+            for k in keys:
+                row = self._rows.get(k)
+                if row is None or vectors is None or row >= self._mapped_rows:
+                    result.append(None)
+                else:
+                    result.append(np.array(vectors[row]))
+            return result
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]) -> None:
+        """Ajouter des vecteurs au cache (verrou de fichier pour les autres workers)."""
+        if not keys:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock, open(self.keys_path, "ab") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                self._sync()
+                if self._dim is None:
+                    self._dim = array.shape[1]
+                    self.meta_path.write_text(json.dumps({"dim": self._dim}))
+                fresh = {}
+                for k, vector in zip(keys, array):
+                    if k not in self._rows and k not in fresh:
+                        fresh[k] = vector
+                if not fresh:
+                    return
+                # Les vecteurs sont écrits avant les clés: une clé lue a toujours sa ligne.
+                # Des lignes orphelines (écriture interrompue) sont d'abord tronquées.
+                expected_size = self._line_count * 4 * self._dim
+                if os.path.getsize(self.vectors_path) > expected_size:
+                    os.truncate(self.vectors_path, expected_size)
+                with open(self.vectors_path, "ab") as vectors_file:
+                    vectors_file.write(np.stack(list(fresh.values())).tobytes())
+                lines = "".join(f"{k}\n" for k in fresh).encode()
+                keys_file.write(lines)
+                keys_file.flush()
+                for k in fresh:
+                    self._rows[k] = self._line_count
+                    self._line_count += 1
+                self._keys_offset += len(lines)
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings avec cache persistant: un chunk déjà vu (même texte, même modèle)
+    n'est jamais renvoyé à l'API. Les chunks manquants sont envoyés par lots de
+    EMBEDDING_BATCH_SIZE, au plus EMBEDDING_MAX_CONCURRENCY requêtes simultanées (tous
+    fichiers confondus), avec nouvelles tentatives sur limitation de débit (429) et erreurs
+    transitoires. Les embeddings des questions sont conservés dans un cache LRU en mémoire.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore = None):
+        self.embeddings = embeddings
+        self.store = store if store is not None else EmbeddingStore(settings.EMBEDDING_CACHE_DIR, settings.EMBEDDING_MODEL_ID)
+        self.batch_size = settings.EMBEDDING_BATCH_SIZE
+        self._executor = ThreadPoolExecutor(max_workers=settings.EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="embedding")
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Instant avant lequel aucune requête n'est envoyée (après un 429, pour tous les threads)
+        self._resume_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+        self.retries = 0
+
+    def embed_documents(self, texts: List[str], on_batch: Callable[[int], None] = None) -> List[List[float]]:
+        """
+        Embeddings des textes (cache, puis lots parallèles pour les manquants).
+        on_batch(n) est appelé avec le nombre de textes disponibles: d'abord ceux du cache,
+        puis après chaque lot embeddé.
+        """
+        keys = [self.store.key(text) for text in texts]
+        cached = self.store.get_many(keys)
+
+        # Textes manquants, sans doublon
+        missing = {}
+        for k, text, vector in zip(keys, texts, cached):
+            if vector is None:
+                missing.setdefault(k, text)
+        occurrences = Counter(k for k, vector in zip(keys, cached) if vector is None)
+
+        with self._lock:
+            self.hits += len(texts) - sum(occurrences.values())
+            self.misses += len(missing)
+        if on_batch is not None and len(texts) > sum(occurrences.values()):
+            on_batch(len(texts) - sum(occurrences.values()))
+
+        computed = {}
+        if missing:
+            logger.info(f"Cache d'embeddings: {len(missing)} chunks à embedder sur {len(texts)}")
+            batch_keys = list(missing)
+            batches = [batch_keys[i:i + self.batch_size] for i in range(0, len(batch_keys), self.batch_size)]
+            futures = [self._executor.submit(self._embed_batch, [missing[k] for k in batch]) for batch in batches]
+            for batch, future in zip(batches, futures):
+                vectors = future.result()
+                # Chaque lot est persisté dès sa réception (rien n'est perdu si un lot suivant échoue)
+                self.store.put_many(batch, vectors)
+                computed.update(zip(batch, vectors))
+                if on_batch is not None:
+                    on_batch(sum(occurrences[k] for k in batch))
+
+        return [
+            vector.tolist() if vector is not None else list(computed[k])
+            for k, vector in zip(keys, cached)
+        ]
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                self.query_hits += 1
+                return list(vector)
+            self.query_misses += 1
+
+        vector = self._embed_batch([text])[0]
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > settings.QUERY_EMBEDDING_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        return list(vector)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Un appel à l'API, répété sur 429, erreur serveur ou réseau (attente exponentielle ou Retry-After)."""
+        for attempt in range(settings.EMBEDDING_MAX_RETRIES + 1):
+            wait = self._resume_at - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                # MistralAIEmbeddings enveloppe l'erreur HTTP dans une RetryError (tenacity)
+                error = e.last_attempt.exception() if isinstance(e, RetryError) else e
+                delay = self._retry_delay(error, attempt)
+                if delay is None or attempt == settings.EMBEDDING_MAX_RETRIES:
+                    raise error
+                logger.warning(f"Embeddings: {error}, nouvelle tentative dans {delay:.1f}s")
+                with self._lock:
+                    self._resume_at = max(self._resume_at, time.time() + delay)
+                    self.retries += 1
+
+    @staticmethod
+    def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+        """Attente avant une nouvelle tentative, ou None si l'erreur n'est pas transitoire."""
+        backoff = min(settings.EMBEDDING_RETRY_MAX_WAIT, constants.EMBEDDING_RETRY_BASE_DELAY * 2 ** attempt)
+        backoff *= random.uniform(1.0, 1.25)
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            if status == 429:
+                retry_after = error.response.headers.get("retry-after", "")
+                if retry_after.replace(".", "", 1).isdigit():
+                    return min(settings.EMBEDDING_RETRY_MAX_WAIT, float(retry_after))
+                return backoff
+            return backoff if status >= 500 else None
+        if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+            return backoff
+        return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            queries = self.query_hits + self.query_misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.store),
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses,
+                "query_hit_rate": self.query_hits / queries if queries else 0.0,
+                "query_entries": len(self._queries),
+                "retries": self.retries,
+            }
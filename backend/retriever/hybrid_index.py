@@ -0,0 +1,437 @@
+import hashlib
+import math
+import sys
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Set, Tuple
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+from .bm25 import DocumentTerms, analyze
+from .dedup import NearDuplicateIndex, NearDuplicateStats
+from .vector_store import DocumentCollections
+from ..config import constants
+from ..config.settings import settings
+from ..utils.logging import logger
+
+
+def chunk_id(doc: Document) -> str:
+    """Identifiant stable d'un chunk: hachage SHA-256 de son contenu."""
+    return hashlib.sha256(doc.page_content.encode()).hexdigest()
+
+
+def with_score(doc: Document, key: str, score: float) -> Document:
+    """Copie du chunk portant un score en métadonnée (le chunk indexé n'est pas modifié)."""
+    return Document(page_content=doc.page_content, metadata={**doc.metadata, key: score})
+
+
+class IncrementalBM25Retriever(BaseRetriever):
+    """
+    Récupérateur BM25 composé d'un index par document (voir DocumentTerms), ajouté ou retiré
+    fichier par fichier sans reconstruire le corpus. Les index sont persistés dans
+    CACHE_DIR/bm25 à côté des chunks en cache: après un redémarrage, rien n'est retokenisé.
+    Les statistiques (idf, longueur moyenne) sont globales à la session et le score est
+    calculé terme par terme sur les tableaux de postings (NumPy vectorisé).
+    """
+
+    k: int = 4
+    k1: float = 1.5
+    b: float = 0.75
+
+    _files: Dict[str, DocumentTerms] = PrivateAttr(default_factory=dict)
+    _docs: Dict[str, List[Document]] = PrivateAttr(default_factory=dict)
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return analyze(text)
+
+    @staticmethod
+    def index_path(file_hash: str) -> Path:
+        return Path(settings.CACHE_DIR) / "bm25" / f"{file_hash}.npz"
+
+    def add_file(self, file_hash: str, chunks: Dict[str, Document], replace: bool = False) -> None:
+        """
+        Indexer les chunks (identifiant -> document) d'un fichier, depuis l'index persisté si possible.
+        Avec replace, l'index du fichier ne contient plus que ces chunks.
+        """
+        with self._lock:
+            docs = {str(cid): doc for cid, doc in zip(self._files[file_hash].ids, self._docs[file_hash])} if file_hash in self._files else {}
+        if chunks.keys() == docs.keys() or (not replace and chunks.keys() <= docs.keys()):
+            return
+        docs = dict(chunks) if replace else {**docs, **chunks}
+
+        # Lecture ou construction hors verrou: les recherches en cours ne sont pas bloquées
+        terms = DocumentTerms.load(self.index_path(file_hash)) if file_hash else None
+        if terms is None or set(terms.ids.tolist()) != docs.keys():
+            ids = list(docs)
+            terms = DocumentTerms.build(ids, [docs[cid].page_content for cid in ids])
+            if file_hash:
+                terms.save(self.index_path(file_hash))
+            logger.info(f"Index BM25 construit pour {file_hash or 'chunks sans fichier'}: {len(ids)} chunks, {len(terms.vocab)} termes")
+        with self._lock:
+            self._files[file_hash] = terms
+            self._docs[file_hash] = [docs[cid] for cid in terms.ids.tolist()]
+
+    def remove_file(self, file_hash: str) -> None:
+        """Retirer l'index d'un fichier (le fichier persisté est conservé pour une prochaine session)."""
+        with self._lock:
+            self._files.pop(file_hash, None)
+            self._docs.pop(file_hash, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(terms) for terms in self._files.values())
+
+    def memory_usage(self) -> int:
+        """Estimation (octets) du texte des chunks et des tableaux de l'index."""
+        with self._lock:
+            text = sum(sys.getsizeof(doc.page_content) for docs in self._docs.values() for doc in docs)
+            return text + sum(terms.nbytes() for terms in self._files.values())
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [with_score(doc, constants.BM25_SCORE_KEY, score) for doc, score in self.search(query, self.k)]
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        """
+        Rechercher les k chunks les mieux classés par BM25.
+        Retourne des couples (document, score calibré 0-1), du meilleur au moins bon.
+        """
+        with self._lock:
+            files = [(self._files[h], self._docs[h]) for h in self._files]
+        n_docs = sum(len(terms) for terms, _ in files)
+        if n_docs == 0:
+            return []
+        avg_length = max(sum(float(terms.lengths.sum()) for terms, _ in files) / n_docs, 1.0)
+
+        # idf global: fréquences documentaires cumulées sur les fichiers de la session
+        query_terms = self.tokenize(query)
+        postings = [[terms.lookup(term) for term in query_terms] for terms, _ in files]
+        idfs = []
+        for i in range(len(query_terms)):
+            df = sum(len(file_postings[i][0]) for file_postings in postings)
+            idfs.append(math.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+        # Score de référence: un chunk de longueur moyenne contenant une fois chaque terme
+        # de la requête (termes absents du corpus compris) obtient la somme des idf
+        ideal = sum(idfs)
+
+        candidates = []
+        for (terms, docs), file_postings in zip(files, postings):
+            scores = np.zeros(len(terms), dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * terms.lengths / avg_length)
+            for (rows, tfs), idf in zip(file_postings, idfs):
+                if len(rows):
+                    scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            candidates.extend((float(scores[row]), docs[row]) for row in matched)
+
+        # Un chunk présent dans plusieurs fichiers n'est retourné qu'une fois
+        candidates.sort(key=lambda pair: pair[0], reverse=True)
+        results, seen = [], set()
+        for score, doc in candidates:
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            # Score calibré (0-1): part du score de référence atteinte par le chunk
+            results.append((doc, min(1.0, score / ideal) if ideal else 0.0))
+            if len(results) == k:
+                break
+        return results
+
+
+def fuse(
+    results: List[List[Tuple[Document, float]]], weights: Sequence[float], k: int, method: str = "rrf"
+) -> List[Document]:
+    """
+    Fusionner les résultats de plusieurs signaux (listes de couples (document, score calibré),
+    du meilleur au moins bon) dans l'espace commun des identifiants de chunks, et retourner
+    les k meilleurs chunks. Chaque chunk porte le score fusionné (HYBRID_SCORE_KEY) et les
+    scores calibrés des signaux qui l'ont retourné.
+
+    - "rrf": somme pondérée de 1 / (RRF_K + rang), un signal absent ne contribue pas;
+    - "convex": combinaison pondérée des scores normalisés min-max par signal (0 si absent).
+    """
+    rows: Dict[str, int] = {}
+    docs: List[Document] = []
+    positions = []
+    for signal in results:
+        signal_rows = []
+        for doc, _ in signal:
+            row = rows.setdefault(chunk_id(doc), len(docs))
+            if row == len(docs):
+                docs.append(doc)
+            signal_rows.append(row)
+        positions.append(np.asarray(signal_rows, dtype=np.int64))
+    if not docs:
+        return []
+
+    n_signals = len(results)
+    scores = np.zeros((n_signals, len(docs)), dtype=np.float32)
+    present = np.zeros((n_signals, len(docs)), dtype=bool)
+    ranks = np.full((n_signals, len(docs)), np.inf, dtype=np.float32)
+    for i, (signal, signal_rows) in enumerate(zip(results, positions)):
+        if not len(signal_rows):
+            continue
+        scores[i, signal_rows] = [score for _, score in signal]
+        present[i, signal_rows] = True
+        ranks[i, signal_rows] = np.arange(1, len(signal_rows) + 1)
+
+    w = np.asarray(weights, dtype=np.float32)[:, None]
+    if method == "convex":
+        low = np.where(present, scores, np.inf).min(axis=1, keepdims=True)
+        high = np.where(present, scores, -np.inf).max(axis=1, keepdims=True)
+        span = high - low
+        # Un signal dont tous les candidats ont le même score leur donne 1
+        normalized = np.where(span > 0, (scores - low) / np.where(span > 0, span, 1), 1.0)
+        fused = (w * np.where(present, normalized, 0.0)).sum(axis=0)
+    else:
+        fused = (w / (constants.RRF_K + ranks)).sum(axis=0)
+
+    top = min(k, len(docs))
+    order = np.argsort(-fused, kind="stable")[:top]
+    keys = (constants.BM25_SCORE_KEY, constants.VECTOR_SCORE_KEY)
+    fused_docs = []
+    for row in order:
+        metadata = dict(docs[row].metadata)
+        for i in range(n_signals):
+            if present[i, row]:
+                metadata[keys[i]] = float(scores[i, row])
+        metadata[constants.HYBRID_SCORE_KEY] = float(fused[row])
+        fused_docs.append(Document(page_content=docs[row].page_content, metadata=metadata))
+    return fused_docs
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Récupérateur hybride natif: les candidats BM25 (BM25_SEARCH_K) et vectoriels (VECTOR_SEARCH_K)
+    de la session sont alignés sur les identifiants de chunks et fusionnés au niveau des scores
+    (voir fuse) avant d'appliquer un seul top-k (HYBRID_TOP_K).
+    """
+
+    index: object
+    k: int = 16
+    method: str = "rrf"
+    weights: Tuple[float, float] = (0.4, 0.6)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical = self.index.bm25.search(query, settings.BM25_SEARCH_K)
+        semantic = []
+        if self.index.collections is not None:
+            # Similarité cosinus (1 - distance) comme score calibré; une collection partagée peut contenir
+            # des chunks que la session n'indexe pas (ex: ancien découpage du document), ignorés
+            semantic = [
+                (doc, 1.0 - distance)
+                for doc, distance in self.index.collections.search(self.index.file_hashes, query, settings.VECTOR_SEARCH_K)
+                if chunk_id(doc) in self.index
+            ]
+        return fuse([lexical, semantic], self.weights, self.k, self.method)
+
+
+class HybridIndex:
+    """
+    Index hybride (BM25 + vecteurs) d'une session, mis à jour de façon incrémentale.
+    Ajouter un fichier n'indexe et n'embedde que ses propres chunks; les vecteurs sont
+    stockés dans la collection partagée du document (voir DocumentCollections).
+    """
+
+    def __init__(self, session_id: str, collections: DocumentCollections = None, dedup_stats: NearDuplicateStats = None):
+        self.session_id = session_id
+        self.collections = collections
+        self.bm25 = IncrementalBM25Retriever()
+        self.dedup = NearDuplicateIndex(stats=dedup_stats)
+        self._lock = threading.RLock()
+        self._file_chunks: Dict[str, Set[str]] = defaultdict(set)
+        self._chunk_owners: Dict[str, Set[str]] = defaultdict(set)
+        # Chunks enfants de chaque section parente (identifiant de chunk -> chunk)
+        self._parents: Dict[str, Dict[str, Document]] = defaultdict(dict)
+
+        if self.collections is None:
+            logger.info("Utilisation du récupérateur BM25 uniquement.")
+        weights = settings.HYBRID_RETRIEVER_WEIGHTS
+        if len(weights) != 2:
+            logger.warning(f"Poids incorrects: {weights}, utilisation des poids par défaut")
+            weights = (0.4, 0.6)
+        method = settings.HYBRID_FUSION
+        if method not in ("rrf", "convex"):
+            logger.warning(f"Méthode de fusion inconnue: {method}, utilisation de rrf")
+            method = "rrf"
+        # Avec un reranker, davantage de candidats sont retournés pour être reclassés
+        k = settings.RERANK_CANDIDATES if settings.RERANKER != "none" else settings.HYBRID_TOP_K
+        # Sans collections, seul le signal BM25 est fusionné (même ordre, même top-k)
+        self.retriever = HybridRetriever(index=self, k=k, method=method, weights=tuple(weights))
+
+    @property
+    def file_hashes(self) -> frozenset:
+        with self._lock:
+            return frozenset(self._file_chunks)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._chunk_owners)
+
+    def __contains__(self, cid: str) -> bool:
+        with self._lock:
+            return cid in self._chunk_owners
+
+    def memory_usage(self) -> int:
+        return self.bm25.memory_usage() + self.dedup.memory_usage()
+
+    def add_documents(self, docs: List[Document], on_embedded: Callable[[int], None] = None, replace: bool = False) -> int:
+        """
+        Ajouter les chunks d'un ou plusieurs fichiers (métadonnée `file_hash`).
+        Un quasi-doublon d'un chunk de la session (voir NearDuplicateIndex) est remplacé par
+        ce chunk, dont le fichier devient aussi propriétaire: son texte n'est ni embeddé ni indexé
+        (la collection et l'index BM25 du fichier reçoivent le représentant, déjà embeddé).
+        L'index BM25 d'un fichier déjà analysé est relu depuis le disque, et seuls les chunks
+        absents de la collection du document sont embeddés (progression via on_embedded).
+        L'embedding et la construction de l'index BM25 ont lieu hors du verrou de l'index:
+        les questions de la session ne sont pas bloquées pendant l'ingestion.
+        Avec replace (indexation progressive d'un PDF en cours d'OCR), les chunks de ces fichiers
+        absents de docs sont retirés. Retourne le nombre de nouveaux chunks indexés.
+        """
+        with self._lock:
+            known = set(self._chunk_owners)
+            owned = {h: set(self._file_chunks.get(h, ())) for h in {doc.metadata.get("file_hash", "") for doc in docs}}
+        new_chunks = {}
+        by_file = defaultdict(dict)
+        signed = []
+        examined, merged, chars_removed = 0, 0, 0
+        for doc in docs:
+            cid = chunk_id(doc)
+            file_hash = doc.metadata.get("file_hash", "")
+            length = len(doc.page_content)
+            representative = None
+            if self.dedup.enabled and cid not in known and cid not in new_chunks:
+                representative = self.dedup.find_or_add(cid, doc)
+                if representative is None:
+                    signed.append(cid)
+                else:
+                    doc = Document(page_content=representative.page_content, metadata={**representative.metadata, "file_hash": file_hash})
+                    cid = chunk_id(doc)
+            # Un fichier réindexé (indexation progressive, nouvel envoi) n'est compté qu'une fois
+            if cid not in owned[file_hash]:
+                examined += 1
+                if representative is not None:
+                    merged += 1
+                    chars_removed += length
+            if cid not in known and cid not in new_chunks:
+                new_chunks[cid] = doc
+            by_file[file_hash][cid] = doc
+
+        try:
+            if self.collections is not None:
+                for file_hash, chunks in by_file.items():
+                    self.collections.acquire(self.session_id, file_hash, list(chunks.values()), list(chunks), on_embedded)
+            for file_hash, chunks in by_file.items():
+                self.bm25.add_file(file_hash, chunks, replace)
+        except Exception:
+            with self._lock:
+                for cid in signed:
+                    if cid not in self._chunk_owners:
+                        self.dedup.remove(cid)
+            raise
+
+        # Seul l'enregistrement des nouveaux chunks se fait sous le verrou
+        with self._lock:
+            added = sum(1 for cid in new_chunks if cid not in self._chunk_owners)
+            if replace:
+                for file_hash, chunks in by_file.items():
+                    self._release(file_hash, self._file_chunks.get(file_hash, set()) - chunks.keys())
+            for file_hash, chunks in by_file.items():
+                for cid, doc in chunks.items():
+                    self._chunk_owners[cid].add(file_hash)
+                    self._file_chunks[file_hash].add(cid)
+                    parent_id = doc.metadata.get(constants.PARENT_ID_KEY)
+                    if parent_id is not None:
+                        self._parents[parent_id].setdefault(cid, doc)
+            total = len(self._chunk_owners)
+
+        if self.dedup.enabled:
+            self.dedup.counters.record(examined, merged, chars_removed)
+        logger.info(
+            f"Session {self.session_id}: {added} nouveaux chunks indexés ({total} au total), "
+            f"{merged} quasi-doublons fusionnés."
+        )
+        return added
+
+    def remove_document(self, file_hash: str) -> int:
+        """
+        Retirer un fichier de l'index. Les chunks partagés avec un autre fichier
+        de la session sont conservés. Retourne le nombre de chunks supprimés.
+        """
+        with self._lock:
+            removed = self._release(file_hash, self._file_chunks.pop(file_hash, set()))
+            self.bm25.remove_file(file_hash)
+            if self.collections is not None:
+                self.collections.release(self.session_id, file_hash)
+
+            logger.info(f"Session {self.session_id}: fichier {file_hash} retiré, {len(removed)} chunks supprimés.")
+            return len(removed)
+
+    def _release(self, file_hash: str, cids: Set[str]) -> Set[str]:
+        """Retirer le fichier des propriétaires de ces chunks (verrou tenu); retourne les chunks supprimés."""
+        removed = set()
+        for cid in cids:
+            self._file_chunks.get(file_hash, set()).discard(cid)
+            owners = self._chunk_owners[cid]
+            owners.discard(file_hash)
+            if not owners:
+                del self._chunk_owners[cid]
+                removed.add(cid)
+        for cid in removed:
+            self.dedup.remove(cid)
+        if removed:
+            for parent_id in list(self._parents):
+                children = self._parents[parent_id]
+                for cid in removed & children.keys():
+                    del children[cid]
+                if not children:
+                    del self._parents[parent_id]
+        return removed
+
+    def parent_documents(self, documents: List[Document]) -> Dict[str, Document]:
+        """
+        Sections parentes des chunks (identifiant du parent -> section), reconstituées à partir
+        des chunks enfants indexés et de leur position dans le parent. La section porte les
+        métadonnées du premier chunk de la liste qui en est issu.
+        """
+        parents = {}
+        for doc in documents:
+            parent_id = doc.metadata.get(constants.PARENT_ID_KEY)
+            if parent_id is None or parent_id in parents:
+                continue
+            with self._lock:
+                children = list(self._parents.get(parent_id, {}).values())
+            if not children:
+                continue
+            text = ""
+            for child in sorted(children, key=lambda c: c.metadata.get(constants.START_INDEX_KEY, 0)):
+                start = child.metadata.get(constants.START_INDEX_KEY, 0)
+                if start + len(child.page_content) <= len(text):
+                    continue
+                # Les chunks se chevauchent (texte identique) ou sont séparés par des espaces
+                text = text[:start].ljust(start) + child.page_content
+            metadata = {k: v for k, v in doc.metadata.items() if k != constants.START_INDEX_KEY}
+            parents[parent_id] = Document(page_content=text.strip(), metadata=metadata)
+        return parents
+
+    def close(self) -> None:
+        """Libérer toutes les collections référencées par la session."""
+        for file_hash in self.file_hashes:
+            self.remove_document(file_hash)
+
+    def invoke(self, question: str) -> List[Document]:
+        return self.retriever.invoke(question)
+
+    async def ainvoke(self, question: str) -> List[Document]:
+        # BM25 et la recherche vectorielle étant synchrones, la recherche s'exécute hors de la boucle d'événements
+        return await self.retriever.ainvoke(question)
@@ -0,0 +1,200 @@
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
+from langchain.schema import Document
+from .vector_store import CollectionRegistry
+from ..config import constants
+from ..config.settings import settings
+from ..utils.logging import logger
+
+
+class VectorFile(NamedTuple):
+    """Vecteurs d'un document: identifiants des lignes, matrice (memory-map) et échelles int8."""
+    ids: List[str]
+    matrix: np.ndarray
+    scales: Optional[np.ndarray]
+    docs: Dict[str, Document]
+
+
+class NumpyCollections(CollectionRegistry):
+    """
+    Registre de vecteurs en fichiers .npy, un par document (hash du fichier), voir
+    CollectionRegistry. Les embeddings sont normalisés et stockés en float32 ou quantifiés
+    en int8 (une échelle par ligne). Les fichiers sont ouverts en memory-map: les workers
+    d'une même machine partagent les pages sans copie, et la recherche est un produit
+    matrice-vecteur par document (par blocs de lignes en int8, voir _scores).
+    """
+
+    def __init__(self, embeddings, persist_directory: str = None, dtype: str = None):
+        super().__init__(embeddings)
+        self.persist_directory = persist_directory or settings.NUMPY_INDEX_DIR
+        self.directory = Path(self.persist_directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype or settings.NUMPY_INDEX_DTYPE
+        if self.dtype not in ("float32", "int8"):
+            raise ValueError(f"Type de vecteurs non supporté: {self.dtype}")
+        self._files: Dict[str, VectorFile] = {}
+
+    def collection_name(self, file_hash: str) -> str:
+        return f"{file_hash}.{self.dtype}.npy"
+
+    def _paths(self, file_hash: str) -> Tuple[Path, Path, Path]:
+        return (
+            self.directory / self.collection_name(file_hash),
+            self.directory / f"{file_hash}.{self.dtype}.scale.npy",
+            self.directory / f"{file_hash}.{self.dtype}.ids.json",
+        )
+
+    def _load(self, file_hash: str) -> Optional[VectorFile]:
+        """Fichier du document (ouvert en memory-map au premier accès), ou None s'il n'existe pas."""
+        vector_file = self._files.get(file_hash)
+        if vector_file is not None:
+            return vector_file
+        matrix_path, scale_path, ids_path = self._paths(file_hash)
+        # Le fichier d'identifiants est écrit en dernier: sa présence garantit des vecteurs complets
+        if not ids_path.exists():
+            return None
+        ids = json.loads(ids_path.read_text())
+        # Lignes limitées aux identifiants lus (un autre worker peut être en train de réécrire le fichier)
+        matrix = np.load(matrix_path, mmap_mode="r")[:len(ids)]
+        scales = np.load(scale_path, mmap_mode="r")[:len(ids)] if self.dtype == "int8" else None
+        vector_file = VectorFile(ids, matrix, scales, {})
+        self._files[file_hash] = vector_file
+        return vector_file
+
+    def _encode(self, vectors: List[List[float]]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        if self.dtype == "float32":
+            return matrix, None
+        # Quantification symétrique par ligne: vecteur ≈ ligne int8 * échelle
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _write(self, file_hash: str, current: Optional[VectorFile], ids: List[str], vectors: List[List[float]]) -> VectorFile:
+        """Réécrire le fichier du document avec les nouvelles lignes (remplacement atomique)."""
+        matrix, scales = self._encode(vectors)
+        if current is not None:
+            ids = current.ids + ids
+            matrix = np.concatenate([current.matrix, matrix])
+            if scales is not None:
+                scales = np.concatenate([current.scales, scales])
+
+        matrix_path, scale_path, ids_path = self._paths(file_hash)
+        suffix = f".{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        targets = [(matrix_path, matrix)] + ([(scale_path, scales)] if scales is not None else [])
+        for path, array in targets:
+            tmp = path.with_name(path.name + suffix)
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, path)
+        tmp = ids_path.with_name(ids_path.name + suffix)
+        tmp.write_text(json.dumps(ids))
+        os.replace(tmp, ids_path)
+
+        self._files.pop(file_hash, None)
+        vector_file = self._load(file_hash)
+        if current is not None:
+            vector_file.docs.update(current.docs)
+        return vector_file
+
+    def acquire(
+        self, session_id: str, file_hash: str, docs: List[Document], ids: List[str],
+        on_progress: Callable[[int], None] = None
+    ) -> None:
+        """
+        Référencer les vecteurs du document pour une session.
+        Seuls les chunks absents du fichier (déjà écrit par une autre session, un autre worker
+        ou un processus précédent) sont embeddés; on_progress(n) est appelé avec le nombre
+        de chunks disponibles après chaque lot d'embeddings.
+        """
+        with self._lock:
+            current = self._load(file_hash)
+            existing = set(current.ids) if current is not None else set()
+        missing = [(cid, doc) for cid, doc in zip(ids, docs) if cid not in existing]
+        if on_progress is not None and len(ids) > len(missing):
+            on_progress(len(ids) - len(missing))
+        vectors = []
+        if missing:
+            vectors = self.embeddings.embed_documents([doc.page_content for _, doc in missing], on_batch=on_progress)
+
+        with self._lock:
+            # Fichier relu: il a pu être écrit par un autre thread pendant le calcul des embeddings
+            current = self._load(file_hash)
+            existing = set(current.ids) if current is not None else set()
+            new = [(cid, vector) for (cid, _), vector in zip(missing, vectors) if cid not in existing]
+            if new:
+                current = self._write(file_hash, current, [cid for cid, _ in new], [vector for _, vector in new])
+            current.docs.update(zip(ids, docs))
+            refs = self._reference(session_id, file_hash)
+            logger.info(
+                f"Vecteurs {self.collection_name(file_hash)}: {len(new)} chunks ajoutés, "
+                f"{refs} session(s) référençante(s)."
+            )
+
+    def _unload(self, file_hash: str) -> None:
+        self._files.pop(file_hash, None)
+
+    def _delete(self, file_hash: str) -> None:
+        self._files.pop(file_hash, None)
+        for path in self.directory.glob(f"{file_hash}.*"):
+            path.unlink(missing_ok=True)
+        logger.info(f"Vecteurs du document {file_hash} supprimés du disque.")
+
+    def _collections(self) -> Set[str]:
+        # Tous les fichiers d'un document (y compris dans un autre type de vecteurs) portent son hash
+        return {self.collection_name(path.name.split(".")[0]) for path in self.directory.glob("*.npy")}
+
+    def _drop(self, name: str) -> None:
+        self._delete(name.split(".")[0])
+
+    def disk_usage(self) -> int:
+        """Taille totale (octets) des fichiers de vecteurs."""
+        total = 0
+        for path in self.directory.iterdir():
+            try:
+                total += path.stat().st_size
+            except OSError:
+                continue
+        return total
+
+    def _scores(self, vector_file: VectorFile, query_vector: np.ndarray) -> np.ndarray:
+        """
+        Similarités cosinus des lignes du document avec la question (normalisée).
+        En int8, le produit est calculé par blocs de VECTOR_SCORE_BLOCK_ROWS lignes: seul
+        le bloc courant est converti en float32, jamais la matrice entière du memory-map.
+        """
+        matrix = vector_file.matrix
+        if vector_file.scales is None:
+            return matrix @ query_vector
+        scores = np.empty(len(matrix), dtype=np.float32)
+        block = constants.VECTOR_SCORE_BLOCK_ROWS
+        for start in range(0, len(matrix), block):
+            scores[start:start + block] = matrix[start:start + block] @ query_vector
+        return scores * vector_file.scales
+
+    def _candidates(self, file_hashes, query: str, k: int) -> List[Tuple[Document, float]]:
+        with self._lock:
+            vector_files = [self._files[h] for h in file_hashes if h in self._files]
+        if not vector_files:
+            return []
+
+        # Un seul embedding (normalisé) de la question pour tous les documents
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1
+        results = []
+        for vector_file in vector_files:
+            scores = self._scores(vector_file, query_vector)
+            top = min(k, len(scores))
+            if top == 0:
+                continue
+            for row in np.argpartition(-scores, top - 1)[:top]:
+                doc = vector_file.docs.get(vector_file.ids[row])
+                if doc is not None:
+                    results.append((doc, 1.0 - float(scores[row])))
+        return results
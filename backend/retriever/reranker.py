@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+from langchain.schema import Document
+from .bm25 import analyze
+from .hybrid_index import chunk_id
+from ..config import constants
+from ..config.settings import settings
+from ..utils.logging import logger
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:  # sentence-transformers absent: seul le scoreur lexical est disponible
+    CrossEncoder = None
+
+
+def lexical_score(query_terms: List[str], text: str) -> float:
+    """
+    Score lexical (0-1) d'un passage: part des termes de la question qu'il contient, complétée
+    par la part des paires de termes consécutifs de la question qu'il contient dans le même ordre
+    (BM25 ignore l'ordre des mots).
+    """
+    if not query_terms:
+        return 0.0
+    terms = analyze(text)
+    vocabulary = set(terms)
+    query_vocabulary = set(query_terms)
+    coverage = len(query_vocabulary & vocabulary) / len(query_vocabulary)
+    query_pairs = set(zip(query_terms, query_terms[1:]))
+    if not query_pairs:
+        return coverage
+    pairs = set(zip(terms, terms[1:]))
+    return 0.7 * coverage + 0.3 * len(query_pairs & pairs) / len(query_pairs)
+
+
+class Reranker:
+    """
+    Reclassement local (CPU) des candidats du récupérateur hybride avant la recherche:
+    scoreur lexical rapide, ou cross-encoder sentence-transformers (RERANK_MODEL) évalué par lots.
+    Les scores sont mis en cache par (question, chunk): une relance ou une question répétée
+    ne recalcule que les nouveaux passages.
+    """
+
+    def __init__(self, method: str = None, model_name: str = None, cache_size: int = None):
+        self.method = method or settings.RERANKER
+        self.model_name = model_name or settings.RERANK_MODEL
+        self.cache_size = settings.RERANK_CACHE_SIZE if cache_size is None else cache_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.method not in ("none", "lexical", "cross-encoder"):
+            logger.warning(f"Reranker inconnu: {self.method}, reclassement désactivé")
+            self.method = "none"
+        if self.method == "cross-encoder" and CrossEncoder is None:
+            logger.warning("sentence-transformers non installé, utilisation du reranker lexical")
+            self.method = "lexical"
+
+    @property
+    def enabled(self) -> bool:
+        return self.method != "none"
+
+    def _cross_encoder(self):
+        """Cross-encoder chargé au premier reclassement (téléchargé une fois dans le cache Hugging Face)."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    logger.info(f"Chargement du cross-encoder {self.model_name}...")
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _score(self, question: str, texts: List[str]) -> List[float]:
+        if self.method == "cross-encoder":
+            pairs = [(question, text) for text in texts]
+            return [float(s) for s in self._cross_encoder().predict(pairs, batch_size=settings.RERANK_BATCH_SIZE)]
+        query_terms = analyze(question)
+        return [lexical_score(query_terms, text) for text in texts]
+
+    def rerank(self, question: str, documents: List[Document]) -> List[Document]:
+        """
+        Reclasser les passages pour la question (score en métadonnée RERANK_SCORE_KEY).
+        Tous les candidats sont conservés: la recherche n'en utilise que les premiers
+        (RERANK_TOP_N) et les relances élargissent le contexte dans cet ordre.
+        """
+        if not self.enabled or not documents:
+            return documents
+        question_key = " ".join(question.lower().split())
+        keys = [(question_key, chunk_id(doc)) for doc in documents]
+
+        scores: Dict[Tuple[str, str], float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+        missing = {key: doc for key, doc in zip(keys, documents) if key not in scores}
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            try:
+                computed = self._score(question, [doc.page_content for doc in missing.values()])
+            except Exception as e:
+                # Un reclassement en échec ne doit pas faire échouer la question: ordre de fusion conservé
+                logger.warning(f"Reclassement impossible, ordre du récupérateur conservé: {e}")
+                return documents
+            scores.update(zip(missing, computed))
+            with self._lock:
+                self._scores.update(zip(missing, computed))
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        # Tri stable: à score égal, l'ordre de la fusion hybride départage
+        order = sorted(range(len(documents)), key=lambda i: -scores[keys[i]])
+        return [
+            Document(
+                page_content=documents[i].page_content,
+                metadata={**documents[i].metadata, constants.RERANK_SCORE_KEY: scores[keys[i]]},
+            )
+            for i in order
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "method": self.method,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._scores),
+            }
@@ -0,0 +1,266 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from ..config.settings import settings
+from ..utils.logging import logger
+
+
+def new_session() -> Dict:
+    return {
+        "file_hashes": frozenset(),
+        "retriever": None,
+        "last_access": time.time()
+    }
+
+
+def session_memory_usage(session: Dict) -> int:
+    """Estimation (octets) de la mémoire occupée par l'index d'une session."""
+    retriever = session.get("retriever")
+    return retriever.memory_usage() if retriever is not None else sys.getsizeof(session)
+
+
+class SessionStore:
+    """
+    Stockage des sessions (fichiers chargés + index hybride), borné en mémoire.
+    Les sessions les moins récemment utilisées sont évincées quand le budget mémoire
+    (SESSION_MEMORY_BUDGET_MB) ou le nombre de sessions (MAX_SESSIONS) est dépassé,
+    et toute session inactive depuis SESSION_IDLE_TTL secondes est supprimée.
+    """
+
+    def __init__(self, collections=None):
+        self.collections = collections
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Retourner la session (et la marquer comme récemment utilisée), ou None."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session["last_access"] = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id: str) -> Dict:
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                session = new_session()
+                self._sessions[session_id] = session
+            return session
+
+    def save(self, session_id: str, session: Dict) -> None:
+        """Enregistrer les modifications d'une session puis appliquer la politique d'éviction."""
+        with self._lock:
+            session["last_access"] = time.time()
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self.evict(keep=session_id)
+
+    def delete(self, session_id: str) -> None:
+        """Supprimer définitivement une session et libérer ses collections."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None and session.get("retriever") is not None:
+            session["retriever"].close()
+        logger.info(f"Session {session_id} supprimée.")
+
+    def _unload(self, session_id: str) -> None:
+        """Retirer une session de la mémoire (éviction LRU). Sans persistance, elle est perdue."""
+        self.delete(session_id)
+
+    def evict(self, keep: str = None) -> List[str]:
+        """Appliquer le TTL d'inactivité puis le budget mémoire; retourne les sessions évincées."""
+        evicted = []
+        with self._lock:
+            now = time.time()
+            for sid in [s for s, sess in self._sessions.items() if s != keep and now - sess["last_access"] > settings.SESSION_IDLE_TTL]:
+                self.delete(sid)
+                evicted.append(sid)
+
+            budget = settings.SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+            usage = sum(session_memory_usage(s) for s in self._sessions.values())
+            # L'OrderedDict est trié du moins au plus récemment utilisé
+            for sid in [s for s in self._sessions if s != keep]:
+                if usage <= budget and len(self._sessions) <= settings.MAX_SESSIONS:
+                    break
+                usage -= session_memory_usage(self._sessions[sid])
+                self._unload(sid)
+                evicted.append(sid)
+
+        if evicted:
+            logger.info(f"Sessions évincées: {evicted}")
+        return evicted
+
+    def ensure_disk_capacity(self, keep: str = None) -> None:
+        """
+        Faire respecter le plafond d'espace disque avant une ingestion: supprimer d'abord les
+        collections orphelines, puis les sessions les moins récemment utilisées.
+        """
+        limit = settings.CHROMA_MAX_DISK_MB * 1024 * 1024
+        if self.collections is None or self.collections.disk_usage() <= limit:
+            return
+        self.collections.evict_unreferenced()
+        for sid in self._lru_order():
+            if self.collections.disk_usage() <= limit:
+                return
+            if sid != keep:
+                self.delete(sid)
+        if self.collections.disk_usage() > limit:
+            raise ValueError(f"L'espace disque des index dépasse la limite de {settings.CHROMA_MAX_DISK_MB}MB")
+
+    def _lru_order(self) -> List[str]:
+        with self._lock:
+            return list(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions persistées dans une base SQLite locale partagée par tous les workers:
+    seuls les hashes des fichiers et l'emplacement de leurs index sont enregistrés.
+    Une session absente de la mémoire (autre worker, redémarrage, éviction LRU) est
+    réhydratée à la demande depuis le cache de chunks et les collections Chroma persistées,
+    sans nouvel appel OCR ni embedding.
+    """
+
+    def __init__(self, path: str, rehydrate: Callable[[str, frozenset], object], collections=None):
+        super().__init__(collections)
+        self.rehydrate = rehydrate
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db_lock = threading.Lock()
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    file_hashes TEXT NOT NULL,
+                    index_location TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+        if collections is not None:
+            # Une collection référencée par une session persistée ne doit jamais être supprimée
+            collections.external_refs = self.referenced_file_hashes
+
+    def _row(self, session_id: str):
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT file_hashes, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            session = super().get(session_id)
+            if session is not None:
+                self._touch(session_id)
+                return session
+
+            row = self._row(session_id)
+            if row is None:
+                return None
+            if time.time() - row[1] > settings.SESSION_IDLE_TTL:
+                self.delete(session_id)
+                return None
+
+        # Réhydratation hors verrou: les autres sessions restent accessibles pendant la reconstruction
+        file_hashes = frozenset(json.loads(row[0]))
+        logger.info(f"Réhydratation de la session {session_id} ({len(file_hashes)} fichiers)")
+        retriever = self.rehydrate(session_id, file_hashes) if file_hashes else None
+
+        with self._lock:
+            session = super().get(session_id)
+            if session is None:
+                session = {
+                    "file_hashes": retriever.file_hashes if retriever is not None else file_hashes,
+                    "retriever": retriever,
+                    "last_access": time.time()
+                }
+                self._sessions[session_id] = session
+                retriever = None
+            self._touch(session_id)
+            self.evict(keep=session_id)
+        if retriever is not None:
+            self._discard(session_id, retriever, session)
+        return session
+
+    def _discard(self, session_id: str, retriever, session: Dict) -> None:
+        """
+        Index réhydraté en double (un autre thread a réhydraté la session entre-temps): la session
+        déjà en mémoire est conservée. Les références de collections étant tenues par session,
+        seules celles des fichiers que la session conservée n'utilise pas sont libérées.
+        """
+        logger.info(f"Session {session_id} déjà réhydratée, index en double libéré")
+        if self.collections is not None:
+            for file_hash in retriever.file_hashes - session["file_hashes"]:
+                self.collections.release(session_id, file_hash)
+
+    def save(self, session_id: str, session: Dict) -> None:
+        retriever = session.get("retriever")
+        location = {
+            "vector_backend": settings.VECTOR_BACKEND,
+            "vector_path": self.collections.persist_directory if self.collections is not None else None,
+            "collections": [self.collections.collection_name(h) for h in session["file_hashes"]] if self.collections is not None else [],
+            "chunk_cache": [str(Path(settings.CACHE_DIR) / f"{h}.pkl") for h in session["file_hashes"]],
+            "chunks": len(retriever) if retriever is not None else 0,
+        }
+        with self._db_lock, self._db:
+            self._db.execute(
+                """INSERT INTO sessions (session_id, file_hashes, index_location, last_access)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(session_id) DO UPDATE SET
+                       file_hashes = excluded.file_hashes,
+                       index_location = excluded.index_location,
+                       last_access = excluded.last_access""",
+                (session_id, json.dumps(sorted(session["file_hashes"])), json.dumps(location), time.time())
+            )
+        super().save(session_id, session)
+
+    def _touch(self, session_id: str) -> None:
+        with self._db_lock, self._db:
+            self._db.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+
+    def delete(self, session_id: str) -> None:
+        # La ligne est supprimée avant de libérer les collections pour qu'elles puissent l'être
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        super().delete(session_id)
+
+    def _unload(self, session_id: str) -> None:
+        """Éviction mémoire: la session reste persistée et sera réhydratée au prochain accès."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None and session.get("retriever") is not None:
+            session["retriever"].close()
+
+    def evict(self, keep: str = None) -> List[str]:
+        # Sessions expirées, y compris celles qu'aucun worker n'a en mémoire
+        with self._db_lock:
+            expired = [
+                sid for (sid,) in self._db.execute(
+                    "SELECT session_id FROM sessions WHERE last_access < ?",
+                    (time.time() - settings.SESSION_IDLE_TTL,)
+                )
+                if sid != keep
+            ]
+        for sid in expired:
+            self.delete(sid)
+        return expired + super().evict(keep)
+
+    def _lru_order(self) -> List[str]:
+        with self._db_lock:
+            return [sid for (sid,) in self._db.execute("SELECT session_id FROM sessions ORDER BY last_access")]
+
+    def referenced_file_hashes(self) -> frozenset:
+        """Hashes de fichiers référencés par au moins une session persistée."""
+        with self._db_lock:
+            rows = self._db.execute("SELECT file_hashes FROM sessions").fetchall()
+        return frozenset(h for (hashes,) in rows for h in json.loads(hashes))
@@ -0,0 +1,221 @@
+import os
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Set, Tuple
+import chromadb
+from langchain.schema import Document
+from langchain_community.vectorstores import Chroma
+from ..config import constants
+from ..config.settings import settings
+from ..utils.logging import logger
+
+
+class CollectionRegistry:
+    """
+    Base des registres de vecteurs, une collection par document (hash du fichier).
+    Un document partagé par plusieurs sessions n'est stocké et embeddé qu'une fois:
+    chaque session en détient une référence, et la collection est supprimée du disque
+    quand la dernière référence est libérée. Les sous-classes fournissent le stockage
+    (_unload, _delete, _collections, _drop, _candidates), acquire et disk_usage.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self._lock = threading.RLock()
+        self._refs: Dict[str, Set[str]] = defaultdict(set)
+        # Références externes (ex: sessions persistées par d'autres workers), voir SQLiteSessionStore
+        self.external_refs: Callable[[], frozenset] = None
+
+    def collection_name(self, file_hash: str) -> str:
+        raise NotImplementedError
+
+    def _reference(self, session_id: str, file_hash: str) -> int:
+        """Enregistrer la référence d'une session (verrou tenu); retourne le nombre de sessions référençantes."""
+        self._refs[file_hash].add(session_id)
+        return len(self._refs[file_hash])
+
+    def release(self, session_id: str, file_hash: str) -> None:
+        """Libérer la référence d'une session; supprimer la collection si plus personne ne l'utilise."""
+        with self._lock:
+            refs = self._refs.get(file_hash)
+            if refs is None:
+                return
+            refs.discard(session_id)
+            if not refs:
+                del self._refs[file_hash]
+                if self.external_refs is not None and file_hash in self.external_refs():
+                    # Encore utilisée par une session persistée: seul le handle en mémoire est libéré
+                    self._unload(file_hash)
+                else:
+                    self._delete(file_hash)
+
+    def evict_unreferenced(self) -> int:
+        """Supprimer les collections de documents qu'aucune session ne référence (ex: processus précédent)."""
+        with self._lock:
+            referenced = set(self._refs)
+            if self.external_refs is not None:
+                referenced |= self.external_refs()
+            referenced_names = {self.collection_name(h) for h in referenced}
+            orphans = self._collections() - referenced_names
+            for name in orphans:
+                self._drop(name)
+            if orphans:
+                logger.info(f"{len(orphans)} collections non référencées supprimées.")
+            return len(orphans)
+
+    def search(self, file_hashes, query: str, k: int) -> List[Tuple[Document, float]]:
+        """
+        Rechercher les k chunks les plus proches parmi les collections d'une session.
+        Retourne des couples (document, distance cosinus), du plus proche au plus lointain.
+        """
+        results = self._candidates(file_hashes, query, k)
+
+        # Un chunk présent dans plusieurs documents n'est retourné qu'une fois
+        results.sort(key=lambda pair: pair[1])
+        seen = set()
+        unique = []
+        for doc, distance in results:
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            unique.append((doc, distance))
+        return unique[:k]
+
+    def _unload(self, file_hash: str) -> None:
+        """Libérer le handle en mémoire de la collection (les données restent sur disque)."""
+        raise NotImplementedError
+
+    def _delete(self, file_hash: str) -> None:
+        """Supprimer la collection du document du disque."""
+        raise NotImplementedError
+
+    def _collections(self) -> Set[str]:
+        """Noms (voir collection_name) des collections présentes sur disque."""
+        raise NotImplementedError
+
+    def _drop(self, name: str) -> None:
+        """Supprimer une collection du disque d'après son nom (éviction des orphelines)."""
+        raise NotImplementedError
+
+    def _candidates(self, file_hashes, query: str, k: int) -> List[Tuple[Document, float]]:
+        """Jusqu'à k couples (document, distance cosinus) par document de la session, dans le désordre."""
+        raise NotImplementedError
+
+
+class DocumentCollections(CollectionRegistry):
+    """
+    Registre des collections Chroma, une par document (hash du fichier), voir CollectionRegistry.
+    """
+
+    PREFIX = "doc-"
+
+    def __init__(self, embeddings, persist_directory: str = None):
+        super().__init__(embeddings)
+        self.persist_directory = persist_directory or settings.CHROMA_DB_PATH
+        self.client = chromadb.PersistentClient(path=self.persist_directory)
+        self._stores: Dict[str, Chroma] = {}
+
+    def collection_name(self, file_hash: str) -> str:
+        return f"{self.PREFIX}{file_hash[:48]}"
+
+    def _store(self, file_hash: str) -> Chroma:
+        store = self._stores.get(file_hash)
+        if store is None:
+            store = Chroma(
+                collection_name=self.collection_name(file_hash),
+                embedding_function=self.embeddings,
+                client=self.client,
+                collection_metadata={"hnsw:space": "cosine"},
+            )
+            self._stores[file_hash] = store
+        return store
+
+    def acquire(
+        self, session_id: str, file_hash: str, docs: List[Document], ids: List[str],
+        on_progress: Callable[[int], None] = None
+    ) -> None:
+        """
+        Référencer la collection du document pour une session.
+        Seuls les chunks absents de la collection (déjà persistée par une autre session
+        ou un processus précédent) sont embeddés, puis ajoutés par lots de INDEX_BATCH_SIZE;
+        on_progress(n) est appelé avec le nombre de chunks embeddés après chaque lot d'embeddings.
+        """
+        with self._lock:
+            store = self._store(file_hash)
+            existing = set(store.get(ids=ids, include=[])["ids"]) if ids else set()
+        missing = [doc for cid, doc in zip(ids, docs) if cid not in existing]
+        if on_progress is not None and len(ids) > len(missing):
+            on_progress(len(ids) - len(missing))
+        # Embeddings calculés hors verrou, en lots parallèles (et mis en cache): plusieurs documents
+        # s'indexent en même temps, et l'ajout à la collection ne fait ensuite que lire le cache
+        if missing:
+            self.embeddings.embed_documents([doc.page_content for doc in missing], on_batch=on_progress)
+
+        with self._lock:
+            # Collection relue: elle a pu être évincée pendant le calcul des embeddings
+            store = self._store(file_hash)
+            existing = set(store.get(ids=ids, include=[])["ids"]) if ids else set()
+            missing = [(cid, doc) for cid, doc in zip(ids, docs) if cid not in existing]
+            for start in range(0, len(missing), constants.INDEX_BATCH_SIZE):
+                batch = missing[start:start + constants.INDEX_BATCH_SIZE]
+                store.add_documents([doc for _, doc in batch], ids=[cid for cid, _ in batch])
+            refs = self._reference(session_id, file_hash)
+            logger.info(
+                f"Collection {self.collection_name(file_hash)}: {len(missing)} chunks ajoutés, "
+                f"{refs} session(s) référençante(s)."
+            )
+
+    def _unload(self, file_hash: str) -> None:
+        self._stores.pop(file_hash, None)
+
+    def _delete(self, file_hash: str) -> None:
+        self._stores.pop(file_hash, None)
+        try:
+            self.client.delete_collection(self.collection_name(file_hash))
+            logger.info(f"Collection {self.collection_name(file_hash)} supprimée du disque.")
+        except Exception as e:
+            logger.warning(f"Impossible de supprimer la collection {self.collection_name(file_hash)}: {e}")
+
+    def _collections(self) -> Set[str]:
+        names = set()
+        for collection in self.client.list_collections():
+            name = collection if isinstance(collection, str) else collection.name
+            if name.startswith(self.PREFIX):
+                names.add(name)
+        return names
+
+    def _drop(self, name: str) -> None:
+        self.client.delete_collection(name)
+        self._stores = {h: s for h, s in self._stores.items() if self.collection_name(h) != name}
+
+    def disk_usage(self) -> int:
+        """Taille totale (octets) du répertoire de persistance Chroma."""
+        total = 0
+        for root, _, files in os.walk(self.persist_directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+
+    def _candidates(self, file_hashes, query: str, k: int) -> List[Tuple[Document, float]]:
+        with self._lock:
+            stores = [self._stores[h] for h in file_hashes if h in self._stores]
+        if not stores:
+            return []
+
+        # Un seul embedding de la question pour toutes les collections
+        query_embedding = self.embeddings.embed_query(query)
+        results = []
+        for store in stores:
+            try:
+                count = len(store)
+                if count:
+                    results.extend(store.similarity_search_by_vector_with_relevance_scores(
+                        query_embedding, k=min(k, count)
+                    ))
+            except Exception as e:
+                # Collection supprimée entre-temps (éviction concurrente)
+                logger.warning(f"Recherche vectorielle ignorée pour une collection: {e}")
+        return results
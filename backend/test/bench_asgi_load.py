@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+import httpx
+import uvicorn
+
+### 🔹 Charge WSGI (threads bornés) vs ASGI (vues async) face à un LLM simulé
+### Lancer depuis la racine du projet: python -m backend.test.bench_asgi_load [--requests 200 --concurrency 200]
+
+DOCUMENT = "# Rapport annuel\n\n" + "\n\n".join(
+    f"## Section {i}\n\nLe chiffre d'affaires du trimestre {i} atteint {100 + i} millions d'euros." for i in range(20)
+)
+
+
+def mock_llm(latency: float):
+    """Application ASGI imitant l'API Mistral (chat + embeddings) avec une latence fixe."""
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        payload = json.loads(body or b"{}")
+
+        if scope["path"].endswith("/embeddings"):
+            data = [
+                {"object": "embedding", "index": i, "embedding": [((hash(text) >> k) & 0xFF) / 255 for k in range(64)]}
+                for i, text in enumerate(payload.get("input", []))
+            ]
+            response = {"object": "list", "data": data, "model": "mock", "usage": {"prompt_tokens": 1, "total_tokens": 1}}
+        else:
+            await asyncio.sleep(latency)
+            prompt = payload["messages"][-1]["content"]
+            if "vérificateur de pertinence" in prompt:
+                content = "CAN_ANSWER"
+            elif "vérifier l'exactitude" in prompt:
+                content = "Supported: OUI\nUnsupported Claims: []\nContradictions: []\nRelevant: OUI\nAdditional Details: []"
+            else:
+                content = "Le chiffre d'affaires du trimestre 3 atteint 103 millions d'euros."
+            response = {
+                "id": "mock", "object": "chat.completion", "model": "mock",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(response).encode()})
+
+    return app
+
+
+class PooledWSGIServer(WSGIServer):
+    """Serveur WSGI à nombre de threads borné (équivalent d'un worker gunicorn gthread)."""
+
+    request_queue_size = 1024
+
+    def __init__(self, *args, threads: int = 16, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_wsgi(port: int, threads: int):
+    """Processus serveur WSGI (lancé par le benchmark lui-même)."""
+    from backend.wsgi import app
+    server = make_server(
+        "127.0.0.1", port, app,
+        server_class=lambda *a, **k: PooledWSGIServer(*a, threads=threads, **k),
+        handler_class=QuietHandler,
+    )
+    server.serve_forever()
+
+
+def start_server(kind: str, port: int, env: dict, threads: int) -> subprocess.Popen:
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "backend.asgi:application", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "backend.test.bench_asgi_load", "--serve-wsgi", str(port), "--wsgi-threads", str(threads)]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Le serveur n'a pas démarré")
+
+
+async def run_load(base_url: str, path: str, requests: int, concurrency: int):
+    """Envoyer les questions en parallèle et retourner (durée totale, latences, erreurs)."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+        await wait_ready(client)
+        upload = await client.post(
+            "/upload-file",
+            data={"session_id": "bench"},
+            files={"file": ("rapport.md", DOCUMENT.encode(), "text/markdown")},
+        )
+        upload.raise_for_status()
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def ask(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(path, json={"question": f"Chiffre d'affaires du trimestre {i % 20} ?", "session_id": "bench"})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(i) for i in range(requests)))
+        return time.perf_counter() - start, latencies, errors
+
+
+def report(label, elapsed, latencies, errors):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<28} {len(latencies) / elapsed:8.1f} req/s   p50={p50:7.2f} s   p95={p95:7.2f} s   erreurs={errors}")
+
+
+### 🔹 Exécution Principale
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Latence simulée de chaque appel LLM (s)")
+    parser.add_argument("--wsgi-threads", type=int, default=16)
+    parser.add_argument("--serve-wsgi", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_wsgi:
+        serve_wsgi(args.serve_wsgi, args.wsgi_threads)
+        return
+
+    mock_port, wsgi_port, asgi_port = 8790, 8791, 8792
+    mock = uvicorn.Server(uvicorn.Config(mock_llm(args.llm_latency), port=mock_port, log_level="warning"))
+    threading.Thread(target=mock.run, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {
+            **os.environ,
+            "MISTRAL_SERVER_URL": f"http://127.0.0.1:{mock_port}",
+            "MISTRALAI_API_KEY": "bench",
+            "LANGSMITH_API_KEY": "bench",
+            "HF_HUB_OFFLINE": "1",
+            "CACHE_DIR": os.path.join(workdir, "cache"),
+            "EMBEDDING_CACHE_DIR": os.path.join(workdir, "cache", "embeddings"),
+            "UPLOAD_DIR": os.path.join(workdir, "cache", "uploads"),
+            "CHROMA_DB_PATH": os.path.join(workdir, "chroma"),
+        }
+
+        print(f"\n🔍 {args.requests} questions, {args.concurrency} simultanées, 3 appels LLM de {args.llm_latency}s chacun")
+        for label, kind, port, path in [
+            (f"WSGI ({args.wsgi_threads} threads)", "wsgi", wsgi_port, "/process-question"),
+            ("ASGI (vues async)", "asgi", asgi_port, "/async/process-question"),
+        ]:
+            server = start_server(kind, port, env, args.wsgi_threads)
+            try:
+                elapsed, latencies, errors = asyncio.run(
+                    run_load(f"http://127.0.0.1:{port}", path, args.requests, args.concurrency)
+                )
+                report(label, elapsed, latencies, errors)
+            finally:
+                server.terminate()
+                server.wait()
+
+    mock.should_exit = True
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import statistics
+import time
+import httpx
+from mistralai import Mistral
+from langchain_mistralai import ChatMistralAI, MistralAIEmbeddings
+from backend.config.settings import settings
+from backend.agents.workflow import get_workflow
+from backend.document_processor.file_handler import get_document_processor
+from backend.retriever.builder import get_retriever_builder
+from backend.utils.clients import get_http_client
+
+### 🔹 Surcoût par requête avant / après le partage des clients
+### Lancer depuis la racine du projet: python -m backend.test.bench_request_overhead [--network]
+
+def build_per_request():
+    """Reproduire l'ancien chemin: trois modèles de chat, un graphe compilé, un client OCR et un client d'embeddings par requête."""
+    for temperature, max_tokens in [(0.3, 300), (0, 200), (0, 10)]:
+        ChatMistralAI(
+            model=settings.MODEL_ID,
+            api_key=settings.MISTRALAI_API_KEY,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+    get_workflow().build_workflow()
+    Mistral(api_key=settings.MISTRALAI_API_KEY)
+    MistralAIEmbeddings(
+        model=settings.EMBEDDING_MODEL_ID,
+        api_key=settings.MISTRALAI_API_KEY,
+    )
+
+
+def build_shared():
+    """Nouveau chemin: récupérer les instances partagées du processus."""
+    get_workflow()
+    get_document_processor()
+    get_retriever_builder()
+
+
+def measure(fn, iterations):
+    """Exécuter fn plusieurs fois et retourner les durées en millisecondes."""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label, durations):
+    p50 = statistics.median(durations)
+    p95 = sorted(durations)[int(len(durations) * 0.95) - 1]
+    print(f"{label:<40} p50={p50:9.3f} ms   p95={p95:9.3f} ms")
+
+
+def ping_new_client():
+    """Requête avec un client neuf: résolution DNS + handshake TLS à chaque fois."""
+    with httpx.Client(base_url=f"{settings.MISTRAL_SERVER_URL}/v1") as client:
+        client.get("/models")
+
+
+def ping_shared_client():
+    """Requête avec le client partagé: la connexion keep-alive est réutilisée."""
+    get_http_client().get("/models")
+
+
+### 🔹 Exécution Principale
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--network", action="store_true", help="Mesurer aussi le coût TLS vers l'API Mistral")
+    args = parser.parse_args()
+
+    # Préchauffage: le premier appel crée les instances partagées
+    build_shared()
+
+    print("\n🔍 Construction des objets par requête")
+    report("Avant (construction par requête)", measure(build_per_request, args.iterations))
+    report("Après (instances partagées)", measure(build_shared, args.iterations))
+
+    if args.network:
+        ping_shared_client()
+        print("\n🔍 Aller-retour HTTP vers l'API Mistral")
+        report("Avant (nouveau client HTTP)", measure(ping_new_client, args.iterations))
+        report("Après (pool keep-alive partagé)", measure(ping_shared_client, args.iterations))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import hashlib
+import random
+import statistics
+import tempfile
+import time
+import numpy as np
+from langchain.schema import Document
+from backend.config import constants
+from backend.config.settings import settings
+from backend.retriever.hybrid_index import HybridIndex
+from backend.retriever.numpy_store import NumpyCollections
+from backend.retriever.reranker import Reranker, CrossEncoder
+
+### 🔹 Reclassement local des candidats: rappel, latence et tokens envoyés au LLM
+### Lancer depuis la racine du projet: python -m backend.test.bench_rerank [--questions 100 --cross-encoder]
+
+REGIONS = ["Bretagne", "Normandie", "Occitanie", "Provence", "Alsace", "Aquitaine", "Bourgogne", "Lorraine"]
+PRODUCTS = ["assurance habitation", "assurance auto", "prêt immobilier", "compte épargne", "carte bancaire", "crédit conso"]
+FILLER = [
+    "Les équipes commerciales ont été renforcées au cours de la période.",
+    "La direction rappelle que ces chiffres ne sont pas audités.",
+    "Une campagne de communication a accompagné le lancement de l'offre.",
+    "Les conditions tarifaires restent inchangées par rapport à l'exercice précédent.",
+]
+
+
+class HashEmbeddings:
+    """Embeddings déterministes par hachage des mots (aucun appel réseau), comme un sac de mots bruité."""
+
+    def _vector(self, text):
+        vector = np.zeros(256, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 256] += 1
+        return vector.tolist()
+
+    def embed_documents(self, texts, on_batch=None):
+        if on_batch is not None:
+            on_batch(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def build_corpus(rng):
+    """Un chunk par (région, produit): le fait recherché, noyé parmi des phrases proches des autres trimestres."""
+    chunks, questions = [], []
+    for region in REGIONS:
+        for product in PRODUCTS:
+            quarter = rng.randint(1, 4)
+            amount = rng.randint(10, 500)
+            sentences = [f"En {region}, le chiffre d'affaires {product} du trimestre {quarter} atteint {amount} millions d'euros."]
+            sentences += [
+                f"En {other}, le {product} progresse de {rng.randint(1, 9)} % au trimestre {rng.randint(1, 4)}."
+                for other in rng.sample(REGIONS, 2) if other != region
+            ]
+            sentences += rng.sample(FILLER, 2)
+            rng.shuffle(sentences)
+            chunks.append(Document(page_content=" ".join(sentences), metadata={"file_hash": "bench"}))
+            questions.append((f"Quel est le chiffre d'affaires {product} en {region} au trimestre {quarter} ?", len(chunks) - 1))
+    return chunks, questions
+
+
+def recall(results, gold_texts, n):
+    return statistics.mean(gold in [doc.page_content for doc in docs[:n]] for docs, gold in zip(results, gold_texts))
+
+
+def prompt_tokens(results, n):
+    """Tokens estimés des n premiers passages (ce que reçoit l'agent de recherche)."""
+    return statistics.mean(sum(len(doc.page_content) for doc in docs[:n]) / constants.CHARS_PER_TOKEN for docs in results)
+
+
+def timed(fn, items):
+    durations, outputs = [], []
+    for item in items:
+        start = time.perf_counter()
+        outputs.append(fn(item))
+        durations.append((time.perf_counter() - start) * 1000)
+    return outputs, durations
+
+
+def report(label, durations):
+    p50 = statistics.median(durations)
+    p95 = sorted(durations)[max(int(len(durations) * 0.95) - 1, 0)]
+    print(f"{label:<40} p50={p50:9.3f} ms   p95={p95:9.3f} ms")
+
+
+### 🔹 Exécution Principale
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=48)
+    parser.add_argument("--top-n", type=int, default=settings.RERANK_TOP_N)
+    parser.add_argument("--cross-encoder", action="store_true", help="Mesurer aussi le cross-encoder (sentence-transformers)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    settings.CACHE_DIR = tempfile.mkdtemp()
+    settings.RERANKER = "lexical"
+    chunks, questions = build_corpus(rng)
+    questions = (questions * (args.questions // len(questions) + 1))[:args.questions]
+    gold_texts = [chunks[i].page_content for _, i in questions]
+
+    index = HybridIndex("bench", NumpyCollections(HashEmbeddings(), tempfile.mkdtemp()))
+    index.add_documents(chunks)
+    texts = [question for question, _ in questions]
+
+    print(f"\n🔍 Récupération hybride ({len(chunks)} chunks, {settings.RERANK_CANDIDATES} candidats)")
+    candidates, durations = timed(index.invoke, texts)
+    report("Fusion hybride", durations)
+
+    rerankers = [("lexical", Reranker("lexical"))]
+    if args.cross_encoder:
+        if CrossEncoder is None:
+            print("sentence-transformers non installé: cross-encoder ignoré")
+        else:
+            rerankers.append(("cross-encoder", Reranker("cross-encoder")))
+
+    rows = [("Sans reclassement", candidates)]
+    for name, reranker in rerankers:
+        pairs = list(zip(texts, candidates))
+        reranked, cold = timed(lambda pair: reranker.rerank(*pair), pairs)
+        _, warm = timed(lambda pair: reranker.rerank(*pair), pairs)
+        report(f"Reclassement {name} (à froid)", cold)
+        report(f"Reclassement {name} (en cache)", warm)
+        rows.append((f"Reclassement {name}", reranked))
+
+    print(f"\n🔍 Rappel du passage attendu et tokens envoyés au LLM")
+    for label, results in rows:
+        for n in (args.top_n, settings.RESEARCH_CONTEXT_K):
+            print(f"{label:<28} top-{n:<3} rappel={recall(results, gold_texts, n):6.1%}   tokens={prompt_tokens(results, n):7.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import base64
+import io
+import os
+import sys
+import time
+from types import SimpleNamespace
+import pytest
+
+# Aucun appel réseau: des clés factices suffisent si le .env est absent
+os.environ.setdefault("MISTRALAI_API_KEY", "test")
+os.environ.setdefault("LANGSMITH_API_KEY", "test")
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ContentStream
+from backend.config.settings import settings
+from backend.document_processor.file_handler import DocumentProcessor
+
+### 🔹 OCR par lots concurrents d'un upload en mémoire, et résultats partiels
+### Lancer depuis la racine du projet: python -m pytest backend/test/test_ocr_batches.py
+
+PAGES = 40
+
+
+class Upload:
+    """Upload en mémoire partagé par les lots (comme un InMemoryUploadedFile Django)."""
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.file_obj = io.BytesIO(content)
+
+
+class FakeOCR:
+    """Client OCR factice: chaque page est reconnue par sa largeur (100 + numéro de page)."""
+
+    def process(self, model, document, include_image_base64):
+        data = document["document_url"].split(",", 1)[1]
+        reader = PdfReader(io.BytesIO(base64.b64decode(data)))
+        # Laisser les autres lots s'exécuter pendant la requête
+        time.sleep(0.005)
+        pages = []
+        for index, page in enumerate(reader.pages):
+            page_no = int(page.mediabox.width) - 100
+            pages.append(SimpleNamespace(index=index, markdown=f"# Page {page_no}\n\nContenu de la page {page_no}."))
+        return SimpleNamespace(pages=pages)
+
+
+def scanned_pdf() -> bytes:
+    """PDF sans couche texte: des pages de tracés, chacune avec son propre flux de contenu."""
+    writer = PdfWriter()
+    for page_no in range(PAGES):
+        page = writer.add_blank_page(width=100 + page_no, height=100)
+        content = ContentStream(None, None)
+        content.set_data(b"".join(b"%d %d m %d %d l S\n" % (i, page_no, page_no, i) for i in range(200)))
+        page.replace_contents(content)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def switch_often():
+    # Changer de thread très souvent pour exposer les accès concurrents au flux de l'upload
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(settings, "INGEST_MAX_PROCESSES", 0)
+    monkeypatch.setattr(settings, "OCR_BATCH_SIZE", 1)
+    monkeypatch.setattr(settings, "OCR_MAX_CONCURRENCY", 8)
+    processor = DocumentProcessor()
+    processor.client = SimpleNamespace(ocr=FakeOCR())
+    return processor
+
+
+def test_concurrent_batches_read_every_page(processor, switch_often):
+    upload = Upload("scan.pdf", scanned_pdf())
+
+    pages = processor._ocr(upload, list(range(PAGES)))
+
+    assert pages == {n: f"# Page {n}\n\nContenu de la page {n}." for n in range(PAGES)}
+
+
+def test_partial_results_before_last_batch(processor, monkeypatch):
+    monkeypatch.setattr(settings, "OCR_PARTIAL_INTERVAL", 1e-6)
+    upload = Upload("scan.pdf", scanned_pdf())
+    partials = []
+
+    chunks = processor.process_file(upload, on_partial=partials.append)
+
+    assert partials
+    # Chaque résultat partiel ne contient que des pages déjà OCRisées, rattachées au fichier
+    assert all(len(partial) < len(chunks) for partial in partials)
+    assert all(chunk.metadata["file_hash"] == upload.file_hash for partial in partials for chunk in partial)
+    assert all("Contenu de la page" in chunk.page_content for partial in partials for chunk in partial)
+    assert sum("Contenu de la page" in chunk.page_content for chunk in chunks) == PAGES
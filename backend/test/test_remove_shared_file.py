@@ -0,0 +1,53 @@
+import os
+import pytest
+
+# Aucun appel réseau: des clés factices suffisent si le .env est absent
+os.environ.setdefault("MISTRALAI_API_KEY", "test")
+os.environ.setdefault("LANGSMITH_API_KEY", "test")
+
+from backend.config.settings import settings
+from backend.document_processor.file_handler import DocumentProcessor
+from backend.document_processor.file_io import FileSource
+from backend.retriever.hybrid_index import HybridIndex, chunk_id
+
+### 🔹 Retrait d'un fichier dont des chunks sont partagés avec un autre fichier de la session
+### Lancer depuis la racine du projet: python -m pytest backend/test/test_remove_shared_file.py
+
+SHARED = "# Conditions générales\n\nLa résiliation du contrat est possible à tout moment par lettre recommandée."
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(settings, "INGEST_MAX_PROCESSES", 0)
+    return DocumentProcessor()
+
+
+def write(tmp_path, name, specific):
+    path = tmp_path / name
+    path.write_text(f"{SHARED}\n\n# Annexe\n\n{specific}", encoding="utf-8")
+    return FileSource(str(path))
+
+
+def test_remove_file_keeps_shared_chunks(tmp_path, processor):
+    first = write(tmp_path, "premier.md", "Le premier contrat couvre le vol de vélos électriques.")
+    second = write(tmp_path, "second.md", "Le second contrat couvre les dégâts des eaux.")
+
+    chunks = processor.process([first, second])
+    # Chaque fichier garde ses propres chunks, y compris la section commune
+    shared = [chunk for chunk in chunks if "résiliation" in chunk.page_content]
+    assert {chunk.metadata["file_hash"] for chunk in shared} == {first.file_hash, second.file_hash}
+
+    index = HybridIndex("test")
+    index.add_documents(chunks)
+    assert len(index) == 3
+
+    assert index.remove_document(first.file_hash) == 1
+    assert index.file_hashes == {second.file_hash}
+    assert chunk_id(shared[0]) in index
+    contents = [doc.page_content for doc in index.invoke("résiliation du contrat")]
+    assert shared[0].page_content in contents
+    assert all("vélos" not in content for content in index.invoke("vol de vélos"))
+
+    assert index.remove_document(second.file_hash) == 2
+    assert len(index) == 0
@@ -1,4 +1,4 @@
-from .views import index, upload_file, process_question, load_file
+from .views import index, upload_file, upload_files, process_question, load_file, remove_file, metrics, ingestion_status, process_question_stream, aupload_file, aprocess_question
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
@@ -7,7 +7,15 @@ urlpatterns = [
     path('', index),
     path('load-file', load_file),
     path('upload-file', upload_file),
+    path('upload-files', upload_files),
+    path('remove-file', remove_file),
+    path('ingestion-status/<str:job_id>', ingestion_status),
     path('process-question', process_question),
+    path('process-question-stream', process_question_stream),
+    path('metrics', metrics),
+    # Vues asynchrones, à servir en ASGI (uvicorn backend.asgi:application)
+    path('async/upload-file', aupload_file),
+    path('async/process-question', aprocess_question),
 ]
 
 if settings.DEBUG:
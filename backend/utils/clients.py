@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import weakref
+import httpx
+from mistralai import Mistral
+from langchain_mistralai import ChatMistralAI, MistralAIEmbeddings
+from ..config.settings import settings
+
+# Verrou des modèles de chat (un par combinaison de paramètres)
+_lock = threading.RLock()
+
+_loop_clients = weakref.WeakKeyDictionary()
+_chat_models = {}
+
+
+def lazy_singleton(factory):
+    """
+    Envelopper une fabrique pour que son instance soit créée une seule fois,
+    au premier appel, puis partagée par tous les threads du processus.
+    """
+    instance = None
+    lock = threading.Lock()
+
+    def get_instance():
+        nonlocal instance
+        if instance is None:
+            with lock:
+                if instance is None:
+                    instance = factory()
+        return instance
+
+    get_instance.__doc__ = f"Retourner l'instance partagée de {factory.__name__}."
+    return get_instance
+
+
+def _new_http_client(**kwargs) -> httpx.Client:
+    """Créer un client HTTP avec un pool de connexions keep-alive."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=settings.HTTP_TIMEOUT,
+        **kwargs,
+    )
+
+
+class LoopLocalAsyncClient(httpx.AsyncClient):
+    """
+    Client asynchrone dont les requêtes passent par un pool de connexions propre à la boucle
+    d'événements courante: un pool httpx ne peut pas être réutilisé d'une boucle à l'autre
+    (ex: vues async exécutées par async_to_sync sous WSGI), mais est partagé par toutes
+    les requêtes d'un worker ASGI.
+    """
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        client = _loop_clients.get(loop)
+        if client is None:
+            client = _loop_clients[loop] = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=settings.HTTP_TIMEOUT,
+            )
+        return await client.send(request, **kwargs)
+
+
+def create_async_http_client() -> httpx.AsyncClient:
+    """Client HTTP asynchrone partagé par les modèles de chat (ainvoke, astream)."""
+    return LoopLocalAsyncClient(
+        base_url=f"{settings.MISTRAL_SERVER_URL}/v1",
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {settings.MISTRALAI_API_KEY}",
+        },
+        timeout=settings.HTTP_TIMEOUT,
+    )
+
+get_async_http_client = lazy_singleton(create_async_http_client)
+
+
+def create_http_client() -> httpx.Client:
+    """
+    Client HTTP partagé par les modèles de chat et d'embeddings LangChain.
+    Les connexions TLS vers l'API Mistral sont ainsi réutilisées d'une requête à l'autre.
+    """
+    return _new_http_client(
+        base_url=f"{settings.MISTRAL_SERVER_URL}/v1",
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {settings.MISTRALAI_API_KEY}",
+        },
+    )
+
+get_http_client = lazy_singleton(create_http_client)
+
+
+def get_chat_model(temperature: float, max_tokens: int, model: str = None) -> ChatMistralAI:
+    """Retourner le modèle de chat partagé pour ces paramètres (un seul par combinaison)."""
+    key = (model or settings.MODEL_ID, temperature, max_tokens)
+    chat_model = _chat_models.get(key)
+    if chat_model is None:
+        with _lock:
+            chat_model = _chat_models.get(key)
+            if chat_model is None:
+                chat_model = ChatMistralAI(
+                    model=key[0],
+                    api_key=settings.MISTRALAI_API_KEY,
+                    endpoint=f"{settings.MISTRAL_SERVER_URL}/v1",
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    client=get_http_client(),
+                    async_client=get_async_http_client(),
+                )
+                _chat_models[key] = chat_model
+    return chat_model
+
+
+def create_embeddings() -> MistralAIEmbeddings:
+    """Modèle d'embeddings partagé (le tokenizer n'est chargé qu'une fois)."""
+    return MistralAIEmbeddings(
+        model=settings.EMBEDDING_MODEL_ID,
+        api_key=settings.MISTRALAI_API_KEY,
+        endpoint=f"{settings.MISTRAL_SERVER_URL}/v1/",
+        client=get_http_client(),
+        # Les nouvelles tentatives (429, erreurs transitoires) sont gérées par CachedEmbeddings
+        max_retries=1,
+    )
+
+get_embeddings = lazy_singleton(create_embeddings)
+
+
+def create_mistral_client() -> Mistral:
+    """Client Mistral (OCR) partagé, avec son propre pool de connexions."""
+    return Mistral(
+        api_key=settings.MISTRALAI_API_KEY,
+        server_url=settings.MISTRAL_SERVER_URL,
+        client=_new_http_client(follow_redirects=True),
+    )
+
+get_mistral_client = lazy_singleton(create_mistral_client)
@@ -0,0 +1,31 @@
+import math
+from typing import List
+from tokenizers import Tokenizer
+from ..config import constants
+from .clients import get_embeddings
+
+
+def get_tokenizer():
+    """
+    Tokenizer Mistral déjà chargé par le modèle d'embeddings partagé (mistralai/Mixtral-8x7B-v0.1),
+    ou None si LangChain a dû se rabattre sur son tokenizer factice (Hugging Face inaccessible).
+    """
+    tokenizer = getattr(get_embeddings(), "tokenizer", None)
+    return tokenizer if isinstance(tokenizer, Tokenizer) else None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation du nombre de tokens par le nombre de caractères (sans tokenizer)."""
+    return math.ceil(len(text) / constants.CHARS_PER_TOKEN)
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Nombre de tokens de chaque texte (estimation par caractères sans tokenizer réel)."""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [estimate_tokens(text) for text in texts]
+    return [len(encoding.ids) for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+def count_tokens(text: str) -> int:
+    return count_tokens_batch([text])[0]
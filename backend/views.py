@@ -1,17 +1,23 @@
 import json
-import hashlib
 import os
-from django.http import JsonResponse
+import threading
+import weakref
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from typing import List
-from .document_processor.file_handler import DocumentProcessor
-from .retriever.builder import RetrieverBuilder
-from .agents.workflow import AgentWorkflow
+from typing import List, Optional
+from .document_processor.file_handler import get_document_processor, file_digest
+from .document_processor.jobs import IngestionJob, IngestionQueue
+from .retriever.builder import get_retriever_builder
+from .retriever.session_store import SessionStore, SQLiteSessionStore
+from .agents.answer_cache import AnswerCache
+from .agents.workflow import UNCACHEABLE_RELEVANCE, get_workflow
 from .config import constants
 from .config.settings import settings
 from .utils.logging import logger
+from .utils.clients import lazy_singleton
 
 # Configuration LangSmith pour le tracking (si besoin)
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
@@ -19,58 +25,250 @@ os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
 os.environ["LANGCHAIN_API_KEY"] = settings.LANGSMITH_API_KEY
 os.environ["LANGCHAIN_PROJECT"] = "agentic_rag_multi_agent"
 
-# Stockage des sessions (en production, utiliser Redis ou base de données)
-sessions = {}
+def rehydrate_session_index(session_id: str, file_hashes: frozenset):
+    """Reconstruire l'index d'une session persistée depuis le cache de chunks (sans OCR ni embedding)"""
+
+    processor = get_document_processor()
+    chunks = []
+    for file_hash in file_hashes:
+        cached = processor.load_cached_chunks(file_hash)
+        if cached is None:
+            logger.warning(f"Chunks introuvables en cache pour {file_hash}, fichier ignoré")
+            continue
+        chunks.extend(cached)
+    return get_retriever_builder().build_hybrid_index(session_id, chunks)
+
+def create_session_store() -> SessionStore:
+    collections = get_retriever_builder().collections
+    if settings.SESSION_STORE_BACKEND == "sqlite":
+        return SQLiteSessionStore(settings.SESSION_DB_PATH, rehydrate_session_index, collections)
+    return SessionStore(collections)
+
+# Stockage des sessions borné (LRU + TTL), en mémoire ou persisté dans SQLite
+get_session_store = lazy_singleton(create_session_store)
+
+def create_answer_cache() -> AnswerCache:
+    """Cache de réponses partagé, avec les embeddings du constructeur de récupérateur"""
+
+    return AnswerCache(get_retriever_builder().embeddings)
+
+get_answer_cache = lazy_singleton(create_answer_cache)
+
+def load_session(session_id: str):
+    """
+    Session prête à répondre aux questions (réhydratée si besoin).
+    Retourne (session, None), ou (None, réponse d'erreur JSON) sans document ni retriever
+    """
+
+    session = get_session_store().get(session_id)
+    if session is None:
+        return None, JsonResponse({"error": "Aucun document chargé. Veuillez d'abord charger un document."}, status=400)
+    if session["retriever"] is None:
+        return None, JsonResponse({"error": "Aucun retriever disponible. Veuillez recharger le document."}, status=400)
+    return session, None
+
+def answer_cache_key(session) -> Optional[frozenset]:
+    """
+    Fichiers de la session servant de clé au cache des réponses, ou None pendant l'indexation
+    progressive d'un fichier: la réponse ne porte alors que sur une partie du document
+    """
+
+    if session["retriever"].file_hashes != session["file_hashes"]:
+        return None
+    return session["file_hashes"]
+
+def cached_answer(session, question: str):
+    """
+    Question identique ou proche déjà traitée sur les mêmes documents.
+    Retourne (réponse en cache ou None, store): store(result) met la nouvelle réponse en cache
+    sous la clé de la recherche, sauf question hors sujet ou erreur du vérificateur de pertinence
+    """
+
+    answer_cache = get_answer_cache()
+    file_hashes = answer_cache_key(session)
+    if file_hashes is None:
+        return None, lambda result: None
+    cached, question_vector = answer_cache.lookup(file_hashes, question)
+
+    def store(result):
+        if result.get("relevance") not in UNCACHEABLE_RELEVANCE:
+            answer_cache.store(file_hashes, question, result, question_vector)
+
+    return cached, store
 
 def get_file_hashes(uploaded_files: List) -> frozenset:
     """Générer des hashes SHA-256 pour les fichiers téléchargés"""
 
-    hashes = set()
-    for file in uploaded_files:
-        if hasattr(file, 'file_obj'):
-            # Fichier uploadé - lire depuis file_obj
-            file.file_obj.seek(0)  # Remettre au début
-            content = file.file_obj.read()
-            hashes.add(hashlib.sha256(content).hexdigest())
-        else:
-            # Fichier local - lire depuis le chemin
-            with open(file.name, "rb") as f:
-                hashes.add(hashlib.sha256(f.read()).hexdigest())
-    return frozenset(hashes)
+    # Hash calculé en flux, réutilisé s'il a déjà été calculé par le processeur
+    return frozenset(file_digest(file) for file in uploaded_files)
+
+# Une session n'est mise à jour que par un traitement à la fois (requêtes et jobs d'ingestion).
+# Références faibles: le verrou d'une session disparaît dès que plus aucun traitement ne le
+# détient ni ne l'attend, la table ne grossit pas avec les sessions supprimées ou évincées
+_session_locks = weakref.WeakValueDictionary()
+_session_locks_guard = threading.Lock()
+
+def session_lock(session_id: str) -> threading.RLock:
+    with _session_locks_guard:
+        lock = _session_locks.get(session_id)
+        if lock is None:
+            lock = _session_locks[session_id] = threading.RLock()
+        return lock
+
+def index_chunks(session_id, new_hashes: frozenset, chunks, on_embedded=None, replace=False):
+    """
+    Ajouter des chunks à l'index de la session et enregistrer ses fichiers
+    (replace: les chunks d'une indexation partielle absents de chunks sont retirés).
+    Retourne le nombre de nouveaux chunks indexés (les chunks déjà présents ne sont pas comptés)
+    """
+
+    retriever_builder = get_retriever_builder()
+    store = get_session_store()
+
+    with session_lock(session_id):
+        # Libérer les sessions inactives et faire respecter le plafond disque avant d'indexer
+        store.evict(keep=session_id)
+        store.ensure_disk_capacity(keep=session_id)
+
+        # Initialiser la session si nécessaire
+        session = store.get_or_create(session_id)
+
+        # Ajouter les nouveaux chunks à l'index de la session (créé au premier fichier)
+        retriever = session["retriever"]
+        if retriever is None:
+            retriever = retriever_builder.build_hybrid_index(session_id)
+        added = retriever.add_documents(chunks, on_embedded, replace)
+        logger.info(f"Retriever créé: {retriever is not None}")
+
+        # Mettre à jour la session
+        current_hashes = session["file_hashes"] | new_hashes
+        session.update({
+            "file_hashes": current_hashes,
+            "retriever": retriever
+        })
+        store.save(session_id, session)
+
+    logger.info(f"Session {session_id} mise à jour. Retriever: {session['retriever'] is not None}")
+    return added
+
+def index_partial(session_id, file_hash: str, chunks) -> bool:
+    """
+    Indexer les chunks déjà disponibles d'un fichier en cours d'OCR: les questions de la session
+    portent sur ces pages sans attendre la fin du job. Le fichier n'est ajouté aux fichiers de la
+    session qu'à la fin du job. Retourne False si la session contenait déjà le fichier.
+    """
+
+    store = get_session_store()
+    with session_lock(session_id):
+        session = store.get_or_create(session_id)
+        if file_hash in session["file_hashes"]:
+            return False
+        retriever = session["retriever"]
+        if retriever is None:
+            retriever = get_retriever_builder().build_hybrid_index(session_id)
+        retriever.add_documents(chunks, replace=True)
+        session["retriever"] = retriever
+        store.save(session_id, session)
+    return True
+
+def remove_partial(session_id, file_hash: str):
+    """Retirer l'index partiel d'un fichier dont le job a échoué"""
+
+    store = get_session_store()
+    with session_lock(session_id):
+        session = store.get(session_id)
+        if session is None or session["retriever"] is None or file_hash in session["file_hashes"]:
+            return
+        session["retriever"].remove_document(file_hash)
+        store.save(session_id, session)
 
 def process_files(file_objects, session_id, success_message="Fichiers traités avec succès"):
     """Fonction commune pour traiter les fichiers et mettre à jour la session"""
 
-    # Initialiser la session si nécessaire
-    if session_id not in sessions:
-        sessions[session_id] = {
-            "file_hashes": frozenset(),
-            "retriever": None
-        }
-
     # Traiter les documents
-    processor = DocumentProcessor()
-    retriever_builder = RetrieverBuilder()
-
-    chunks = processor.process(file_objects)
+    chunks = get_document_processor().process(file_objects)
     logger.info(f"Chunks générés: {len(chunks)}")
 
-    retriever = retriever_builder.build_hybrid_retriever(chunks)
-    logger.info(f"Retriever créé: {retriever is not None}")
+    new_hashes = get_file_hashes(file_objects)
+    added = index_chunks(session_id, new_hashes, chunks)
 
-    # Mettre à jour la session
-    current_hashes = get_file_hashes(file_objects)
-    sessions[session_id].update({
-        "file_hashes": current_hashes,
-        "retriever": retriever
+    return JsonResponse({
+        "message": success_message,
+        # Chunks uniques réellement indexés: les chunks communs à plusieurs fichiers ne comptent qu'une fois
+        "chunks_count": added,
+        "file_hashes": sorted(new_hashes)
     })
 
-    logger.info(f"Session {session_id} mise à jour. Retriever: {sessions[session_id]['retriever'] is not None}")
+class FileObject:
+    """Fichier téléchargé (ou chemin d'un fichier local), tel qu'attendu par le processeur de documents"""
+
+    def __init__(self, file_obj):
+        if isinstance(file_obj, str):
+            # Fichier local: lu directement depuis le disque par le processeur
+            self.name = file_obj
+            return
+        self.name = file_obj.name
+        self.file_obj = file_obj
+
+def run_ingestion(job: IngestionJob, file):
+    """
+    Exécuter un job d'ingestion: OCR/découpage, puis indexation pour chaque session rattachée.
+    Une erreur de traitement ou un fichier sans chunk fait échouer le job avant tout rattachement;
+    les pages déjà OCRisées sont interrogeables entre-temps (voir index_partial).
+    """
+
+    partial = set()
+    def on_partial(chunks):
+        for session_id in job.sessions():
+            if index_partial(session_id, job.file_hash, chunks):
+                partial.add(session_id)
+        job.update("split", chunks=len(chunks))
+        job.advance("indexing", "partial")
+
+    try:
+        chunks = get_document_processor().process_file(
+            file, on_page=lambda f, page_no, markdown: job.advance("ocr", "pages"), on_partial=on_partial
+        )
+    except Exception:
+        for session_id in partial:
+            remove_partial(session_id, job.file_hash)
+        raise
+    job.update("split", chunks=len(chunks))
+    job.update("embedding", total=len(chunks))
+
+    # L'embedding n'a lieu que pour la première session; les suivantes réutilisent la collection
+    embedded = {"first": True}
+    def on_embedded(n):
+        if embedded["first"]:
+            job.advance("embedding", "done", n)
+
+    while (session_id := job.next_session()) is not None:
+        index_chunks(session_id, frozenset({job.file_hash}), chunks, on_embedded, replace=session_id in partial)
+        embedded["first"] = False
+        job.advance("indexing", "sessions")
+
+def create_ingestion_queue() -> IngestionQueue:
+    return IngestionQueue(run_ingestion)
 
+# File de jobs d'ingestion en arrière-plan (bornée, dédupliquée par hash de fichier)
+get_ingestion_queue = lazy_singleton(create_ingestion_queue)
+
+def submit_jobs(file_objects, session_id):
+    """Créer les jobs d'ingestion et répondre immédiatement avec leurs identifiants"""
+
+    try:
+        # Tout le lot est accepté ou refusé: jamais de jobs créés sans identifiants retournés
+        jobs = get_ingestion_queue().submit_many(file_objects, session_id)
+    except RuntimeError as e:
+        return JsonResponse({"error": str(e)}, status=503)
     return JsonResponse({
-        "message": success_message,
-        "chunks_count": len(chunks)
-    })
+        "message": "Ingestion en cours",
+        "job_ids": [job.id for job in jobs],
+        "file_hashes": [job.file_hash for job in jobs]
+    }, status=202)
+
+def is_background(data) -> bool:
+    return str(data.get('background', '')).lower() in ("1", "true", "yes")
 
 @csrf_exempt
 @require_http_methods(["GET"])
@@ -90,19 +288,41 @@ def upload_file(request):
         if not file.name.lower().endswith(tuple(constants.ALLOWED_TYPES)):
             return JsonResponse({"error": f"Type de fichier non supporté: {file.name}"}, status=400)
 
-        # Créer l'objet fichier pour le processeur
-        class FileObject:
-            def __init__(self, file_obj):
-                self.name = file_obj.name
-                self.file_obj = file_obj
-
         file_object = FileObject(file)
+        if is_background(request.POST):
+            return submit_jobs([file_object], session_id)
         return process_files([file_object], session_id, "Fichier traité avec succès")
 
     except Exception as e:
         logger.error(f"Erreur lors du traitement du fichier: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def upload_files(request):
+    """Télécharger et traiter plusieurs fichiers en parallèle"""
+
+    files = request.FILES.getlist('files')
+    session_id = request.POST.get('session_id', 'default')
+
+    try:
+        if not files:
+            return JsonResponse({"error": "Aucun fichier reçu."}, status=400)
+
+        # Valider les fichiers
+        unsupported = [f.name for f in files if not f.name.lower().endswith(tuple(constants.ALLOWED_TYPES))]
+        if unsupported:
+            return JsonResponse({"error": f"Types de fichiers non supportés: {', '.join(unsupported)}"}, status=400)
+
+        file_objects = [FileObject(f) for f in files]
+        if is_background(request.POST):
+            return submit_jobs(file_objects, session_id)
+        return process_files(file_objects, session_id, f"{len(file_objects)} fichiers traités avec succès")
+
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement des fichiers: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def load_file(request):
@@ -117,11 +337,9 @@ def load_file(request):
         file_path = os.path.join(settings.EXAMPLES_DIR, file_name)
 
         # Créer un objet fichier pour le processeur
-        class FileObject:
-            def __init__(self, path):
-                self.name = path
-
         file_obj = FileObject(file_path)
+        if is_background(data):
+            return submit_jobs([file_obj], session_id)
 
         response = process_files([file_obj], session_id, "Fichier chargé avec succès")
         response_data = json.loads(response.content)
@@ -132,6 +350,58 @@ def load_file(request):
         logger.error(f"Erreur lors du chargement du fichier: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def ingestion_status(request, job_id):
+    """Suivre la progression d'un job d'ingestion (pages OCRisées, chunks embeddés)"""
+
+    job = get_ingestion_queue().get(job_id)
+    if job is None:
+        return JsonResponse({"error": "Job introuvable."}, status=404)
+    return JsonResponse(job.to_dict())
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def remove_file(request):
+    """Retirer un fichier de l'index de la session"""
+
+    data = json.loads(request.body)
+    file_hash = data.get('file_hash', '').strip()
+    session_id = data.get('session_id', 'default')
+
+    try:
+        store = get_session_store()
+        with session_lock(session_id):
+            session = store.get(session_id)
+            if session is None or file_hash not in session["file_hashes"]:
+                return JsonResponse({"error": "Fichier introuvable dans cette session."}, status=404)
+
+            removed = session["retriever"].remove_document(file_hash) if session["retriever"] is not None else 0
+            session["file_hashes"] = session["file_hashes"] - {file_hash}
+            store.save(session_id, session)
+
+        return JsonResponse({
+            "message": "Fichier retiré avec succès",
+            "removed_chunks": removed
+        })
+
+    except Exception as e:
+        logger.error(f"Erreur lors du retrait du fichier: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def metrics(request):
+    """Exposer les compteurs des caches et des chemins de décision de pertinence"""
+
+    return JsonResponse({
+        "embedding_cache": get_retriever_builder().embeddings.stats(),
+        "near_duplicates": get_retriever_builder().dedup_stats.stats(),
+        "relevance": get_workflow().relevance_checker.stats(),
+        "reranker": get_workflow().reranker.stats(),
+        "answer_cache": get_answer_cache().stats(),
+    })
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def process_question(request):
@@ -142,18 +412,20 @@ def process_question(request):
     session_id = data.get('session_id', 'default')
 
     try:
-        # Vérifier que la session existe et a un retriever
-        if session_id not in sessions:
-            return JsonResponse({"error": "Aucun document chargé. Veuillez d'abord charger un document."}, status=400)
+        session, error = load_session(session_id)
+        if error is not None:
+            return error
 
-        if sessions[session_id]["retriever"] is None:
-            return JsonResponse({"error": "Aucun retriever disponible. Veuillez recharger le document."}, status=400)
+        cached, store = cached_answer(session, question)
+        if cached is not None:
+            return JsonResponse(cached)
 
-        workflow = AgentWorkflow()
+        workflow = get_workflow()
         result = workflow.full_pipeline(
             question=question,
-            retriever=sessions[session_id]["retriever"]
+            retriever=session["retriever"]
         )
+        store(result)
 
         return JsonResponse({
             "draft_answer": result["draft_answer"],
@@ -164,3 +436,107 @@ def process_question(request):
         logger.error(f"Erreur lors du traitement de la question: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
 
+@csrf_exempt
+@require_http_methods(["POST"])
+async def aupload_file(request):
+    """Version asynchrone de upload_file (déploiement ASGI)"""
+
+    file = request.FILES.get('file')
+    session_id = request.POST.get('session_id', 'default')
+
+    try:
+        # Valider le fichier
+        if file is None or not file.name.lower().endswith(tuple(constants.ALLOWED_TYPES)):
+            return JsonResponse({"error": f"Type de fichier non supporté: {getattr(file, 'name', None)}"}, status=400)
+
+        # Le traitement (OCR en lots parallèles, découpage, embeddings) s'exécute hors de la boucle d'événements
+        return await sync_to_async(process_files, thread_sensitive=False)(
+            [FileObject(file)], session_id, "Fichier traité avec succès"
+        )
+
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement du fichier: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def aprocess_question(request):
+    """Version asynchrone de process_question: les appels au LLM ne bloquent aucun thread"""
+
+    data = json.loads(request.body)
+    question = data.get('question', '').strip()
+    session_id = data.get('session_id', 'default')
+
+    try:
+        # La réhydratation éventuelle de la session (SQLite, chunks en cache) et la recherche
+        # dans le cache des réponses (embedding de la question) restent synchrones
+        session, error = await sync_to_async(load_session, thread_sensitive=False)(session_id)
+        if error is not None:
+            return error
+
+        cached, store = await sync_to_async(cached_answer, thread_sensitive=False)(session, question)
+        if cached is not None:
+            return JsonResponse(cached)
+
+        result = await get_workflow().afull_pipeline(
+            question=question,
+            retriever=session["retriever"]
+        )
+        store(result)
+
+        return JsonResponse({
+            "draft_answer": result["draft_answer"],
+            "verification_report": result["verification_report"]
+        })
+
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement de la question: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+def sse_event(event: str, data) -> str:
+    """Formater un événement Server-Sent Events"""
+
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def process_question_stream(request):
+    """Traiter une question en diffusant la réponse (SSE): tokens, puis rapport de vérification"""
+
+    data = json.loads(request.body)
+    question = data.get('question', '').strip()
+    session_id = data.get('session_id', 'default')
+
+    try:
+        # La réhydratation de la session (SQLite, chunks en cache) peut échouer: erreur JSON, pas de flux
+        session, error = load_session(session_id)
+    except Exception as e:
+        logger.error(f"Erreur lors du chargement de la session {session_id}: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+    if error is not None:
+        return error
+
+    def events():
+        try:
+            cached, store = cached_answer(session, question)
+            if cached is not None:
+                # Réponse en cache: diffusée d'un bloc
+                yield sse_event("draft", {"draft_answer": cached["draft_answer"]})
+                yield sse_event("verification", {"verification_report": cached["verification_report"]})
+                yield sse_event("done", cached)
+                return
+
+            for event, payload in get_workflow().stream_pipeline(question=question, retriever=session["retriever"]):
+                if event == "done":
+                    store(payload)
+                yield sse_event(event, payload)
+        except Exception as e:
+            logger.error(f"Erreur lors du streaming de la réponse: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Désactiver la mise en tampon des proxys (nginx) pour que les tokens arrivent immédiatement
+    response["X-Accel-Buffering"] = "no"
+    return response
+